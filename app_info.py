@@ -1,4 +1,6 @@
 import streamlit as st
+import pandas as pd
+import sqlite_db
 
 def display_app_info(app_name: str, app_version: str) -> None:
     """ Show app title and description """
@@ -15,4 +17,19 @@ def display_app_info(app_name: str, app_version: str) -> None:
     st.divider()
     with st.expander("System info", icon="🌐"):
         st.markdown(f":streamlit: Streamlit Cloud version {st.__version__}")
-        st.markdown(f"⛃ Database SQLITE Cloud version {st.session_state.sqlite_version}")
+        if st.session_state.get("db_engine") == sqlite_db.DB_ENGINE_LOCAL:
+            st.markdown(f"⛃ Database SQLITE local file {st.session_state.dbname} version {st.session_state.sqlite_version}")
+        else:
+            st.markdown(f"⛃ Database SQLITE Cloud version {st.session_state.sqlite_version}")
+        cache_stats = sqlite_db.get_refdata_cache_stats()
+        st.markdown(f"🗃️ Master data cache: {cache_stats['tables']} tables - {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+        attachment_stats = sqlite_db.get_attachment_cache_stats()
+        st.markdown(f"📎 Attachment cache: {attachment_stats['files']} files, {attachment_stats['bytes'] / 1048576:.1f} / {attachment_stats['max_bytes'] / 1048576:.0f} MB - {attachment_stats['hits']} hits / {attachment_stats['misses']} misses")
+        pool_stats = sqlite_db.get_pool_stats()
+        st.markdown(f"🔌 Connection pool: {pool_stats['in_use']} in use / {pool_stats['size']} open (max {pool_stats['max_size']}) - {pool_stats['waits']} waits, max wait {pool_stats['max_wait_time']:.2f}s, {pool_stats['replaced']} replaced")
+        if st.session_state.get("load_timings"):
+            st.markdown("⏱️ Data load timings (seconds)")
+            st.dataframe(
+                pd.DataFrame(list(st.session_state.load_timings.items()), columns=["TABLE", "SECONDS"]).sort_values("SECONDS", ascending=False),
+                hide_index=True
+            )
@@ -7,6 +7,9 @@ from typing import Optional, Tuple, Dict, List
 import altair as alt
 # Internal app module
 import servant
+import request_stats
+
+DASHBOARD_TOP_WORKORDERS = 20
 
 def dashboard(conn):
 # Show some metrics and charts about the ticket.
@@ -58,16 +61,26 @@ def dashboard(conn):
 
     # Show metrics side by side using `st.columns` and `st.metric`.
     col1, col2, col3, col4 = st.columns(4)
-    num_open_requests = len(st.session_state.df_requests[st.session_state.df_requests["STATUS"] == "NEW"])
-    num_assigned_requests = len(st.session_state.df_requests[st.session_state.df_requests["STATUS"] == "ASSIGNED"])
-    num_completed_requests = len(st.session_state.df_requests[st.session_state.df_requests["STATUS"] == "COMPLETED"])
-    num_pending_requests = len(st.session_state.df_requests[st.session_state.df_requests["STATUS"] == "PENDING"])
+    # Conteggi aggregati in SQL (GROUP BY), condivisi tra le sessioni per STATS_BUCKET_SECONDS
+    request_counts = request_stats.get_request_counts(conn)
+    status_counts = request_stats.get_status_counts(request_counts)
+    num_open_requests = status_counts.get("NEW", 0)
+    num_assigned_requests = status_counts.get("ASSIGNED", 0)
+    num_completed_requests = status_counts.get("COMPLETED", 0)
+    num_pending_requests = status_counts.get("PENDING", 0)
+
 
+    # Variazioni reali: snapshot giornaliero (giorno precedente) e della settimana precedente
+    status_deltas = request_stats.get_status_deltas(conn)
 
-    col1.metric(label="Number of NEW requests", value=num_open_requests, delta=10)
-    col2.metric(label="Number of ASSIGNED requests", value=num_assigned_requests, delta=-1.5)
-    col3.metric(label="Number of COMPLETED requests", value=num_completed_requests, delta=2)
-    col4.metric(label="Number of PENDING requests", value=num_pending_requests, delta=1)
+    def week_help(status):
+        week_delta = status_deltas.get(status, {}).get("week")
+        return f"Week over week: {week_delta:+d}" if week_delta is not None else None
+
+    col1.metric(label="Number of NEW requests", value=num_open_requests, delta=status_deltas.get("NEW", {}).get("day"), help=week_help("NEW"))
+    col2.metric(label="Number of ASSIGNED requests", value=num_assigned_requests, delta=status_deltas.get("ASSIGNED", {}).get("day"), help=week_help("ASSIGNED"))
+    col3.metric(label="Number of COMPLETED requests", value=num_completed_requests, delta=status_deltas.get("COMPLETED", {}).get("day"), help=week_help("COMPLETED"))
+    col4.metric(label="Number of PENDING requests", value=num_pending_requests, delta=status_deltas.get("PENDING", {}).get("day"), help=week_help("PENDING"))
 
     # Verifichiamo i dati
     #st.write("Preview dei dati:")
@@ -76,10 +89,8 @@ def dashboard(conn):
     #st.write("Colonne disponibili:")
     #st.write(st.session_state.df_requests.columns.tolist())
 
-    # Convertiamo la colonna Insdate in datetime se non lo è già
-    st.session_state.df_requests['INSDATE'] = pd.to_datetime(st.session_state.df_requests['INSDATE'])
-    st.session_state.df_requests['DATE'] = st.session_state.df_requests['INSDATE'].dt.strftime('%Y-%m-%d')
-    st.session_state.df_requests['WEEK_YEAR'] = st.session_state.df_requests['INSDATE'].dt.strftime('%U-%Y')
+    df_week_pline = request_stats.count_by(request_counts, ["WEEK_YEAR", "PR_LINE"])
+    df_month_dept = request_stats.count_by(request_counts, ["MONTH", "DEPT"])
     # Grafico semplificato
     # status_plot = alt.Chart(st.session_state.df_requests).mark_bar().encode(
     #     x='month(DATE):O',
@@ -88,9 +99,9 @@ def dashboard(conn):
     # )
     
     # Grafico con Altair
-    status_plot = alt.Chart(st.session_state.df_requests).mark_bar().encode(
-        x=alt.X('WEEK_YEAR:O', title='Week-Year'),
-        y=alt.Y('count():Q', title='Count'),
+    status_plot = alt.Chart(df_week_pline).mark_bar().encode(
+        x=alt.X('WEEK_YEAR:O', title='Year-Week'),
+        y=alt.Y('sum(COUNT):Q', title='Count'),
         color=alt.Color('PR_LINE:N', title='Product Line')
     )
 
@@ -102,9 +113,9 @@ def dashboard(conn):
         st.error(f"Errore nella visualizzazione del grafico: {str(e)}")
 
     # Grafico semplificato
-    dept_plot = alt.Chart(st.session_state.df_requests).mark_bar().encode(
-        x=alt.X('month(DATE):O', title='Month'),
-        y=alt.Y('count():Q', title='Count'),
+    dept_plot = alt.Chart(df_month_dept).mark_bar().encode(
+        x=alt.X('MONTH:O', title='Month'),
+        y=alt.Y('sum(COUNT):Q', title='Count'),
         color=alt.Color('DEPT:N', title='Department')
     )   
 
@@ -112,4 +123,15 @@ def dashboard(conn):
     try:
         st.altair_chart(dept_plot, use_container_width=True)
     except Exception as e:
-        st.error(f"Errore nella visualizzazione del grafico: {str(e)}")
\ No newline at end of file
+        st.error(f"Errore nella visualizzazione del grafico: {str(e)}")
+    # Ore lavorate per work order (i primi DASHBOARD_TOP_WORKORDERS)
+    df_wo_hours = request_stats.get_workorder_hours(conn)
+    if df_wo_hours is not None and not df_wo_hours.empty:
+        hours_plot = alt.Chart(df_wo_hours.head(DASHBOARD_TOP_WORKORDERS)).mark_bar().encode(
+            x=alt.X('WOID:N', title='Work Order', sort='-y'),
+            y=alt.Y('TIME_QTY:Q', title='Hours')
+        )
+        try:
+            st.altair_chart(hours_plot, use_container_width=True)
+        except Exception as e:
+            st.error(f"Errore nella visualizzazione del grafico: {str(e)}")
@@ -0,0 +1,226 @@
+import threading
+import time
+from typing import Callable, Dict
+
+# Global constants
+POOL_MAX_SIZE = 10  # Max open connections per server process
+POOL_ACQUIRE_TIMEOUT = 30  # Seconds to wait for a free connection
+POOL_PING_AFTER = 60  # Seconds of idleness after which a connection is pinged before reuse
+POOL_LEASE_TIMEOUT = 300  # Seconds after which an unused session lease can be reclaimed
+
+
+class ConnectionPool:
+    """ Bounded, thread-safe pool of database connections shared by all sessions """
+
+    def __init__(self, factory: Callable, max_size: int = POOL_MAX_SIZE,
+                 ping_after: float = POOL_PING_AFTER, lease_timeout: float = POOL_LEASE_TIMEOUT):
+        self._factory = factory
+        self._max_size = max_size
+        self._ping_after = ping_after
+        self._lease_timeout = lease_timeout
+        self._idle = []  # (connection, idle since) - used as a stack, warmest first
+        self._leases = set()  # PooledConnection handles currently holding a connection
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "acquired": 0,
+            "created": 0,
+            "replaced": 0,
+            "reclaimed": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+        }
+
+    def acquire(self, timeout: float = POOL_ACQUIRE_TIMEOUT):
+        """ Check out a healthy connection, opening a new one if the pool is not full """
+
+        start = time.monotonic()
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self._max_size:
+                    self._size += 1  # Reserve the slot, connect outside the lock
+                    conn, idle_since = None, None
+                    break
+                if self._reclaim_expired_leases():
+                    continue
+                remaining = start + timeout - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No database connection available after {timeout} seconds")
+                waited = True
+                self._cond.wait(remaining)
+
+            elapsed = time.monotonic() - start
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += elapsed
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], elapsed)
+
+        if conn is None:
+            return self._connect("created")
+        if time.monotonic() - idle_since > self._ping_after and not self._ping(conn):
+            self._close(conn)
+            return self._connect("replaced")
+        return conn
+
+    def try_acquire(self):
+        """ Check out a connection only if one is free right now (None otherwise, never waits) """
+
+        try:
+            return self.acquire(timeout=0)
+        except TimeoutError:
+            return None
+
+    def release(self, conn, broken: bool = False) -> None:
+        """ Give a connection back to the pool (a broken one is closed and its slot freed) """
+
+        with self._cond:
+            if broken:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, float]:
+        """ Return pool size and usage/wait counters """
+
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self._max_size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._stats,
+            }
+
+    def _connect(self, counter: str):
+        """ Open a connection in an already reserved slot """
+
+        try:
+            conn = self._factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats[counter] += 1
+        return conn
+
+    def _ping(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def lease(self, handle) -> None:
+        """ Check out a connection on behalf of a session handle """
+
+        conn = self.acquire()
+        with self._cond:
+            handle._conn = conn
+            self._leases.add(handle)
+
+    def end_lease(self, handle, broken: bool = False) -> None:
+        """ Give back the connection held by a session handle, if any """
+
+        with self._cond:
+            conn, handle._conn = handle._conn, None
+            self._leases.discard(handle)
+        if conn is not None:
+            self.release(conn, broken=broken)
+
+    def _reclaim_expired_leases(self) -> bool:
+        """ Take back connections from session handles unused for lease_timeout (lock held) """
+
+        now = time.monotonic()
+        expired = [
+            h for h in self._leases
+            if h._conn is not None and not h.pins and now - h.last_used > self._lease_timeout
+        ]
+        for handle in expired:
+            conn, handle._conn = handle._conn, None
+            self._leases.discard(handle)
+            self._idle.append((conn, handle.last_used))
+            self._stats["reclaimed"] += 1
+        return bool(expired)
+
+
+class PooledConnection:
+    """ Session handle on the pool: checks a connection out on first use, forwards
+    the DB-API calls to it and gives it back with release() at the end of the run """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._conn = None
+        self.last_used = 0.0
+        self.pins = 0  # Open pin() calls: the lease is not reclaimed while > 0
+
+    def _get(self):
+        self.last_used = time.monotonic()
+        if self._conn is None:
+            self._pool.lease(self)
+        return self._conn
+
+    def cursor(self):
+        return self._get().cursor()
+
+    def execute(self, *args, **kwargs):
+        return self._get().execute(*args, **kwargs)
+
+    def commit(self):
+        return self._get().commit()
+
+    def rollback(self):
+        if self._conn is not None:
+            return self._conn.rollback()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._get(), name)
+
+    def __enter__(self):
+        self._get().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn = self._conn
+        if conn is not None:
+            return conn.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def pin(self) -> None:
+        """ Check a connection out and keep it from being reclaimed until unpin() (e.g. during a transaction) """
+
+        self._get()
+        self.pins += 1
+
+    def unpin(self) -> None:
+        self.pins -= 1
+        self.last_used = time.monotonic()
+
+    def release(self, broken: bool = False) -> None:
+        """ Give the checked-out connection (if any) back to the pool """
+
+        self._pool.end_lease(self, broken=broken)
+
+    def close(self) -> None:
+        self.release()
@@ -139,9 +139,7 @@ def insert_request(conn)-> None:
             'df_detail': sqlite_db.load_detail_data
         }
 
-        for key, loader in session_data.items():
-            if key not in st.session_state:
-                st.session_state[key] = loader(conn)
+        sqlite_db.initialize_session_state(conn, session_data)
 
         # REQUESTER INFO SECTION
         st.subheader(":orange[Requester section]")
@@ -301,8 +299,6 @@ def insert_request(conn)-> None:
         req_nr, rc = sqlite_db.save_request(request_data, conn)
         if rc:
             request_data["reqid"] = req_nr
-            if request_data["attachments_list"]:
-                rc = sqlite_db.save_attachments(req_nr, request_data["attachments_list"], conn)
             display_request_popup(request_data)
             #st.success(f"Request {req_nr} submitted successfully!")
             st.session_state.form_submitted = True
@@ -12,6 +12,137 @@ import servant
 # Internal app module
 import servant
 
+# Weekly timesheet
+WEEK_DAY_NAMES = ["Lun", "Mar", "Mer", "Gio", "Ven"]  # Weekends are hidden in the calendar too
+DAY_MAX_HOURS = 24.0
+
+
+def get_week_days(day: date) -> List[date]:
+    """Return the working days (Monday-Friday) of the week containing day"""
+    monday = day - timedelta(days=day.weekday())
+    return [monday + timedelta(days=i) for i in range(len(WEEK_DAY_NAMES))]
+
+
+def build_week_grid(df_workitems, df_woassignedto, df_tskgrl1, df_tskgrl2, tdsp_code, day_keys) -> Tuple[pd.DataFrame, Dict]:
+    """Return the WOID x day grid of a specialist's active hours and the existing workitems by (refdate, woid)"""
+
+    df_tdsp = df_workitems[df_workitems["TDSPID"] == tdsp_code]
+    in_week = (df_tdsp["REFDATE"] >= pd.Timestamp(day_keys[0])) & (df_tdsp["REFDATE"] < pd.Timestamp(day_keys[-1]) + pd.Timedelta(days=1))
+    df_week = df_tdsp[in_week & (df_tdsp["STATUS"] == "ACTIVE")]
+    df_week = df_week.assign(REFDATE=df_week["REFDATE"].dt.strftime('%Y-%m-%d'))
+    existing = {(row["REFDATE"], row["WOID"]): row for row in df_week.to_dict("records")}
+
+    assigned_woids = df_woassignedto[
+        (df_woassignedto["TDSPID"] == tdsp_code) & (df_woassignedto["STATUS"] == "ACTIVE")
+    ]["WOID"]
+    woids = sorted(set(assigned_woids) | set(df_week["WOID"]))
+
+    # Task groups of a row: the ones of its latest workitem in the week, if any
+    df_latest = df_week.sort_values("REFDATE").drop_duplicates("WOID", keep="last").set_index("WOID")
+    df_grid = pd.DataFrame({"WOID": woids})
+    df_grid["TSKGRL1"] = servant.get_descriptions_from_codes(df_tskgrl1, df_grid["WOID"].map(df_latest["TSKGRL1"]), "NAME")
+    df_grid["TSKGRL2"] = servant.get_descriptions_from_codes(df_tskgrl2, df_grid["WOID"].map(df_latest["TSKGRL2"]), "NAME")
+    df_grid[["TSKGRL1", "TSKGRL2"]] = df_grid[["TSKGRL1", "TSKGRL2"]].where(df_grid[["TSKGRL1", "TSKGRL2"]] != "", None)
+    for day_key in day_keys:
+        df_grid[day_key] = [existing[(day_key, woid)]["TIME_QTY"] if (day_key, woid) in existing else None for woid in woids]
+    return df_grid, existing
+
+
+def collect_week_changes(df_edited, existing, df_tskgrl1, df_tskgrl2, tdsp_code, day_keys) -> Tuple[List[dict], List[str]]:
+    """Validate the edited week grid and return the workitems to save (changed cells only) and the errors"""
+
+    records, errors = [], []
+    tskgrl1_codes = servant.get_code_lookup(df_tskgrl1, "CODE", code_column="NAME")
+    tskgrl2_codes = {(pcode, name): code for pcode, name, code in df_tskgrl2[["PCODE", "NAME", "CODE"]].itertuples(index=False)}
+    hours = df_edited[day_keys].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+
+    for day_key, total in hours.sum().items():
+        if total > DAY_MAX_HOURS:
+            errors.append(f"{day_key}: {total:g} H exceed the {DAY_MAX_HOURS:g} H of a day")
+
+    for (_, row), (_, row_hours) in zip(df_edited.iterrows(), hours.iterrows()):
+        woid = row["WOID"]
+        tskgrl1_code = tskgrl1_codes.get(row["TSKGRL1"])
+        tskgrl2_code = tskgrl2_codes.get((tskgrl1_code, row["TSKGRL2"]))
+        for day_key in day_keys:
+            old_item = existing.get((day_key, woid))
+            old_qty = float(old_item["TIME_QTY"]) if old_item else 0.0
+            new_qty = float(row_hours[day_key])
+            if new_qty == old_qty:
+                continue
+            if new_qty > 0 and not (tskgrl1_code and tskgrl2_code):
+                errors.append(f"{woid}: select a valid TaskGroup L1/L2 pair")
+                break
+            records.append({
+                "REFDATE": day_key,
+                "WOID": woid,
+                "TDSPID": tdsp_code,
+                "STATUS": "ACTIVE" if new_qty > 0 else "DELETED",
+                "TSKGRL1": tskgrl1_code if new_qty > 0 else old_item["TSKGRL1"],
+                "TSKGRL2": tskgrl2_code if new_qty > 0 else old_item["TSKGRL2"],
+                "DESCRIPTION": old_item["DESC"] if old_item else "",
+                "NOTE": old_item["NOTE"] if old_item else "",
+                "TIME_QTY": new_qty if new_qty > 0 else old_qty,
+                "TIME_UM": "H"
+            })
+    return records, errors
+
+
+def show_week_timesheet(conn, tdsp_code) -> None:
+    """Editable WOID x day grid of a specialist's week, saved in one transaction"""
+
+    week_day = st.date_input(label=":blue[Week of]", value=date.today(), format="DD/MM/YYYY", key="week_timesheet_day")
+    week_days = get_week_days(week_day)
+    day_keys = [d.strftime('%Y-%m-%d') for d in week_days]
+    sqlite_db.ensure_workitems_window(conn, week_days[0], week_days[-1], tdsp_code)
+
+    df_grid, existing = build_week_grid(
+        st.session_state.df_workitems, st.session_state.df_woassignedto,
+        st.session_state.df_tskgrl1, st.session_state.df_tskgrl2, tdsp_code, day_keys
+    )
+    if df_grid.empty:
+        st.info("No work orders assigned to this specialist")
+        return
+
+    column_config = {
+        "WOID": st.column_config.TextColumn("Work Order", disabled=True),
+        "TSKGRL1": st.column_config.SelectboxColumn("TaskGroup L1", options=st.session_state.df_tskgrl1["NAME"].tolist()),
+        "TSKGRL2": st.column_config.SelectboxColumn("TaskGroup L2", options=st.session_state.df_tskgrl2["NAME"].unique().tolist()),
+    }
+    for day_name, day, day_key in zip(WEEK_DAY_NAMES, week_days, day_keys):
+        column_config[day_key] = st.column_config.NumberColumn(
+            f"{day_name} {day.strftime('%d/%m')}", min_value=0.0, max_value=DAY_MAX_HOURS, step=0.5, format="%.1f"
+        )
+
+    # A new key after each save drops the edits already written
+    grid_version = st.session_state.get("week_timesheet_version", 0)
+    df_edited = st.data_editor(
+        df_grid,
+        column_config=column_config,
+        hide_index=True,
+        num_rows="fixed",
+        use_container_width=True,
+        key=f"week_timesheet_{tdsp_code}_{day_keys[0]}_{grid_version}"
+    )
+
+    if st.button("Save Week", type="primary", key="week_timesheet_save"):
+        records, errors = collect_week_changes(
+            df_edited, existing, st.session_state.df_tskgrl1, st.session_state.df_tskgrl2, tdsp_code, day_keys
+        )
+        if errors:
+            for error in errors:
+                st.error(error)
+        elif not records:
+            st.info("Nothing to save")
+        elif sqlite_db.save_workitem(records, conn):
+            # Merge the saved cells into df_workitems: no reload from the database
+            df_saved = pd.DataFrame(records).rename(columns={"DESCRIPTION": "DESC"})
+            sqlite_db.merge_session_rows("df_workitems", df_saved[st.session_state.df_workitems.columns])
+            st.session_state.week_timesheet_version = grid_version + 1
+            st.toast(f"{len(records)} workitems saved!")
+            st.rerun()
+
+
 def create_workitem(conn)-> None:
 
     def show_calendar():
@@ -32,69 +163,19 @@ def create_workitem(conn)-> None:
 
         # Aggiungi un pulsante di refresh
         if st.button("🔄 Refresh Calendario"):
+            sqlite_db.refresh_refdata(conn)
             st.session_state.calendar_needs_update = True
 
         cal_col, details_col = st.columns([4, 1])
 
         with cal_col:
-            # Filtra i workitem in base al TD Specialist selezionato
-            if st.session_state.selected_tdsp_code:
-                df_filtered_witems = st.session_state.df_workitems[
-                    st.session_state.df_workitems["TDSPID"] == st.session_state.selected_tdsp_code
-                ].copy()
-            else:
-                df_filtered_witems = st.session_state.df_workitems.copy()
-
-            df_filtered_witems['REFDATE'] = pd.to_datetime(df_filtered_witems['REFDATE']).dt.strftime('%Y-%m-%d')
-
-            # Crea gli eventi per il calendario
-            calendar_events = []
-            st.session_state.event_details = {}  # Reset dei dettagli degli eventi
-
-            for index, row in df_filtered_witems.iterrows():
-                tdsp_name = servant.get_description_from_code(st.session_state.df_users, row['TDSPID'], "NAME")
-                tdspid = row['TDSPID']
-                woid = row['WOID']
-                date = row['REFDATE']
-
-                # Crea una chiave univoca per l'evento
-                event_key = f"{woid}_{date}_{tdspid}"
-
-                # Salva i dettagli dell'evento nella sessione
-                st.session_state.event_details[event_key] = {
-                    "woid": woid,
-                    "tdspid": tdspid,
-                    "tdsp_name": tdsp_name,
-                    "status": row['STATUS'],
-                    "time_qty": row['TIME_QTY'],
-                    "time_um": row.get('TIME_UM', 'H'),
-                    "tskgrl1": row.get('TSKGRL1', ''),
-                    "tskgrl1_name": servant.get_description_from_code(st.session_state.df_tskgrl1, row.get('TSKGRL1', ''), "NAME"),
-                    "tskgrl2": row.get('TSKGRL2', ''),
-                    "tskgrl2_name": servant.get_description_from_code(st.session_state.df_tskgrl2, row.get('TSKGRL2', ''), "NAME"),
-                    "description": row.get('DESC', ''),
-                    "note": row.get('NOTE', ''),
-                    "date": date,
-                    "index": index
-                }
-
-                # Crea l'evento per il calendario
-                if row['STATUS'] == "ACTIVE":
-                    back_color = '#d4efdf'
-                    border_color = '#a2d9ce'
-                else:
-                    back_color = '#efd4d7'
-                    border_color = '#da9ca3'
-                
-                event = {
-                    "id": event_key,
-                    "title": f"[{woid}] - {row['TIME_QTY']} H - {tdsp_name}",
-                    "start": date,
-                    "backgroundColor": back_color,
-                    "borderColor": border_color,
-                    "display": "block"
-                }
-                calendar_events.append(event)
+            # Eventi e dettagli del calendario: ricalcolati solo quando cambiano specialist, finestra o dati
+            calendar_window = (first_day_previous_month.date(), last_day_current_month.date())
+            calendar_events, st.session_state.event_details = servant.get_calendar_events(
+                st.session_state.df_workitems, st.session_state.df_users,
+                st.session_state.df_tskgrl1, st.session_state.df_tskgrl2,
+                st.session_state.selected_tdsp_code, calendar_window
+            )
 
             # Opzioni del calendario
             calendar_options = {
@@ -186,7 +267,7 @@ def create_workitem(conn)-> None:
             if st.session_state.calendar_needs_update:
                 with st.spinner("Aggiornamento calendario..."):
                     # Ricarica i dati dal database
-                    st.session_state.df_workitems = sqlite_db.load_workitems_data(conn)
+                    sqlite_db.reload_session_data("df_workitems", conn)
                     st.session_state.calendar_needs_update = False  # Reset del flag
 
                     # Rigenera il calendario
@@ -257,12 +338,6 @@ def create_workitem(conn)-> None:
 
                         if save_submitted:
                             try:
-                                # Aggiorna il DataFrame originale
-                                df_index = event_data['index']
-                                st.session_state.df_workitems.at[df_index, 'TIME_QTY'] = new_time_qty
-                                st.session_state.df_workitems.at[df_index, 'DESC'] = new_description
-                                st.session_state.df_workitems.at[df_index, 'NOTE'] = new_note
-
                                 # Prepara il dizionario per l'aggiornamento
                                 workitem_dict = {
                                     "REFDATE": event_data['date'],
@@ -281,7 +356,6 @@ def create_workitem(conn)-> None:
                                 rc = sqlite_db.save_workitem(workitem_dict, conn)
                                 st.success("Update successfully!")
 
-                                st.session_state.calendar_needs_update = True
                                 st.session_state.selected_event_key = None  # Imposta esplicitamente a None
                                 if 'selected_event_key' in st.session_state: # Forse non serve più, ma per sicurezza
                                     del st.session_state.selected_event_key
@@ -289,8 +363,8 @@ def create_workitem(conn)-> None:
                                     del st.session_state.event_details
                                     st.write("Rerunning after save") # Debug print    
 
-                                # Forza il refresh del calendario
-                                st.session_state.df_workitems = sqlite_db.load_workitems_data(conn)
+                                # Forza il refresh del calendario (solo il workitem modificato)
+                                sqlite_db.sync_session_data("df_workitems", conn, [(event_data['date'], event_data['woid'], event_data['tdspid'])])
                                 time.sleep(0.1)
                                 st.rerun()
 
@@ -318,15 +392,14 @@ def create_workitem(conn)-> None:
                                 st.success("Work item deleted successfully!")
 
                                 # Aggiorna lo stato della sessione
-                                st.session_state.calendar_needs_update = True
                                 st.session_state.selected_event_key = None  # Imposta esplicitamente a None
                                 if 'selected_event_key' in st.session_state:  # Forse non serve più, ma per sicurezza
                                     del st.session_state.selected_event_key
                                 if 'event_details' in st.session_state:
                                     del st.session_state.event_details
 
-                                # Forza il refresh del calendario
-                                st.session_state.df_workitems = sqlite_db.load_workitems_data(conn)
+                                # Forza il refresh del calendario (solo il workitem cancellato)
+                                sqlite_db.sync_session_data("df_workitems", conn, [(event_data['date'], event_data['woid'], event_data['tdspid'])])
                                 time.sleep(0.1)
                                 st.rerun()
                             except Exception as e:
@@ -352,28 +425,16 @@ def create_workitem(conn)-> None:
         'df_attachments': sqlite_db.load_attachments_data,
         'df_workorders': sqlite_db.load_workorders_data,
         'df_woassignedto': sqlite_db.load_woassignedto_data,
-        'df_workitems': sqlite_db.load_workitems_data,
+        'df_workitems': sqlite_db.load_default_workitems_data,
         'df_tskgrl1': sqlite_db.load_tskgrl1_data,
         'df_tskgrl2': sqlite_db.load_tskgrl2_data,
     }
 
-    for key, loader in session_data.items():
-        if key not in st.session_state:
-            st.session_state[key] = loader(conn)
-
-    previus_xdays = datetime.now() - timedelta(days=10)
-    previus_xdays = previus_xdays.date()
+    sqlite_db.initialize_session_state(conn, session_data)
 
-    if "df_out" not in st.session_state:
-        # Esegui il filtro
-        st.session_state.df_out = st.session_state.df_workitems[
-            st.session_state.df_workitems["REFDATE"].dt.date > previus_xdays
-        ].copy()  # .copy() is important
-
-    # Reload workitems if needed
+    # Reload workitems if needed (df_out is rebuilt below from the synced df)
     if 'reload_needed' in st.session_state and st.session_state.reload_needed:
-        st.session_state.df_workitems = sqlite_db.load_workitems_data(conn)
-        st.session_state.df_out = st.session_state.df_workitems[st.session_state.df_workitems["REFDATE"].dt.date > previus_xdays].copy()
+        sqlite_db.sync_session_data("df_workitems", conn)
         del st.session_state.reload_needed
 
     tdsp_woassignedto_names_df = st.session_state.df_users[st.session_state.df_users["DEPTCODE"]=="DTD"]["NAME"]
@@ -400,14 +461,14 @@ def create_workitem(conn)-> None:
     if st.session_state.selected_tdsp_code:
         filtered_workitems = st.session_state.df_workitems[
             st.session_state.df_workitems["TDSPID"] == st.session_state.selected_tdsp_code
-        ].copy()  # .copy() is crucial here as well
+        ]
     else:
-        filtered_workitems = st.session_state.df_workitems.copy() #.copy() is crucial here as well
+        filtered_workitems = st.session_state.df_workitems
     
     filtered_workitems = filtered_workitems.sort_values(['REFDATE','TDSPID','WOID'], ascending=[False, True, True])
     
 
-    st.session_state.df_out = pd.DataFrame(filtered_workitems)  # No need to drop columns here
+    st.session_state.df_out = filtered_workitems  # No need to drop columns here
 
     # Reset form fields if needed
     if 'form_reset' in st.session_state and st.session_state.form_reset:
@@ -536,6 +597,8 @@ def create_workitem(conn)-> None:
                 success = sqlite_db.save_workitem(witem, conn)
                 if success:
                     st.success("New workitem created!")
+                    # Merge only the saved workitem into df_workitems
+                    sqlite_db.sync_session_data("df_workitems", conn, [(str(execution_date), selected_workorder, selected_tdsp_code)])
                     # # Set a flag in session state to indicate that a reload is needed
                     # st.session_state.reload_needed = True
                     # # Set default values for the form fields
@@ -543,12 +606,6 @@ def create_workitem(conn)-> None:
                     # time.sleep(1)
                     # st.rerun()
 
-                    # Imposta il flag per aggiornare il calendario
-                    st.session_state.calendar_needs_update = True
-                    
-                    # Imposta il flag per ricaricare i dati
-                    st.session_state.reload_needed = True
-                    
                     # Resetta i campi del form
                     st.session_state.form_reset = True
                     
@@ -556,4 +613,7 @@ def create_workitem(conn)-> None:
                     time.sleep(1)  # Breve pausa per mostrare il messaggio di successo
                     st.rerun()
 
+        with st.expander(label=":orange[Weekly Timesheet]", expanded=False):
+            show_week_timesheet(conn, st.session_state.selected_tdsp_code)
+
             
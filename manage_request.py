@@ -8,6 +8,7 @@ from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
 # Internal app module
 import servant
 import sqlite_db
+import request_store
 
 # Global constants
 ACTIVE_STATUS = "ACTIVE"
@@ -47,6 +48,7 @@ def show_request_dialog(selected_row_dict, req_status_options, update_request_fn
     popup_title = f'Richiesta {selected_row_dict["REQID"]}'  # Accedi a REQID direttamente
 
     @st.dialog(popup_title, width="large")
+    @sqlite_db.release_after(conn)
     def dialog_content():
         # ... (Il tuo codice di stile)
 
@@ -54,14 +56,18 @@ def show_request_dialog(selected_row_dict, req_status_options, update_request_fn
 
         # ... (Altre visualizzazioni di input, usando selected_row_dict)
 
-        description = st.session_state.df_requests.loc[st.session_state.df_requests["REQID"] == reqid, "DESCRIPTION"].values[0]
+        request_record = request_store.get_request_record(reqid, conn)
+        if request_record is None:
+            st.warning(f"Request {reqid} not found: it may have been deleted")
+            return
+        description = request_record["DESCRIPTION"]
         st.text_area(label="Descrizione", value=description, disabled=True)
 
         st.divider()
         tdtl_usercode = st.session_state.df_lk_pline_tdtl["USER_CODE"].drop_duplicates().sort_values().tolist() #conversione in lista
         tdtl_username_list = st.session_state.df_users[st.session_state.df_users["CODE"].isin(tdtl_usercode)]["NAME"].tolist()
 
-        tdtl_default_codes = st.session_state.df_reqassignedto[st.session_state.df_reqassignedto["REQID"] == reqid]["TDTLID"].tolist()
+        tdtl_default_codes = request_record["TDTL_CODES"]
 
         if tdtl_default_codes:
             tdtl_option = st.session_state.df_users[st.session_state.df_users["CODE"].isin(tdtl_default_codes)]
@@ -92,7 +98,7 @@ def show_request_dialog(selected_row_dict, req_status_options, update_request_fn
         )
         
         # Display Tech Dept Note
-        default_note_td = str(st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["NOTE_TD"].values[0])
+        default_note_td = str(request_record["NOTE_TD"])
         req_note_td = st.text_area(label=":orange[Tech Department Notes]", value=default_note_td, disabled=False)
 
         if (req_note_td == default_note_td) and (selected_row_dict['STATUS'] == req_status) and (req_tdtl_name == default_tdtl_name): #Usa selected_row_dict
@@ -106,7 +112,7 @@ def show_request_dialog(selected_row_dict, req_status_options, update_request_fn
               st.session_state.grid_refresh = True
               st.session_state.grid_response = None
               st.success(f"Request {reqid} updated successfully!")
-              st.session_state.df_requests = sqlite_db.load_requests_data(conn)  # Ricarica i dati dal database
+              sqlite_db.sync_session_data("df_requests", conn, [reqid])  # Ricarica solo le righe modificate
               st.session_state.need_refresh = True
               time.sleep(3)
               reset_application_state()
@@ -124,6 +130,7 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
     popup_title = f'Richiesta {selected_row_dict["REQID"]}' # Accedi a REQID direttamente
 
     @st.dialog(popup_title, width="large")
+    @sqlite_db.release_after(conn)
     def dialog_content():
         st.markdown(
             """
@@ -176,18 +183,11 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
         # Display request details
         st.text_input(label="Product Line", value=selected_row_dict['PRLINE_NAME'], disabled=True)  # Usa selected_row_dict
         st.text_input(label="Request title", value=selected_row_dict['TITLE'], disabled=True)       # Usa selected_row_dict
-        req_description = st.session_state.df_requests.loc[st.session_state.df_requests["REQID"] == reqid, "DESCRIPTION"]
-        if not req_description.empty:
-            req_description_default = req_description.values[0]
-        else:
-            req_description_default = ""
+        request_record = request_store.get_request_record(reqid, conn) or {}
+        req_description_default = request_record.get("DESCRIPTION", "")
         st.text_input(label="Descrizione della richiesta", value=req_description_default, disabled=True)
 
-        req_note_td = st.session_state.df_requests[st.session_state.df_requests["REQID"]==reqid]["NOTE_TD"]
-        if not req_note_td.empty:
-            req_note_td_default = req_note_td.values[0]
-        else:
-            req_note_td_default = ""
+        req_note_td_default = request_record.get("NOTE_TD", "")
 
         st.divider()
         st.subheader(f"Work Order {woid}")
@@ -203,8 +203,8 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
             wo_type_index = 0  
 
         wo_insdate_filtered = st.session_state.df_workorders[st.session_state.df_workorders["WOID"] == woid]["INSDATE"]
-        if not wo_insdate_filtered.empty:
-            wo_insdate_default = wo_insdate_filtered.values[0]
+        if not wo_insdate_filtered.empty and not pd.isna(wo_insdate_filtered.iloc[0]):
+            wo_insdate_default = wo_insdate_filtered.iloc[0].strftime("%Y-%m-%d")  # Written back as text
         else:
             wo_insdate_default = datetime.datetime.now().strftime("%Y-%m-%d")  # O un valore di default appropriato
 
@@ -235,7 +235,7 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
         tdtl_usercode = st.session_state.df_lk_pline_tdtl["USER_CODE"].drop_duplicates().sort_values().tolist() #conversione in lista
         tdtl_username_list = st.session_state.df_users[st.session_state.df_users["CODE"].isin(tdtl_usercode)]["NAME"].tolist()
 
-        tdtl_default_codes = st.session_state.df_reqassignedto[st.session_state.df_reqassignedto["REQID"] == reqid]["TDTLID"].tolist()
+        tdtl_default_codes = request_record.get("TDTL_CODES", [])
 
         if tdtl_default_codes:
             tdtl_option = df_users[df_users["CODE"].isin(tdtl_default_codes)]
@@ -280,13 +280,12 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
 
         filtered_woassignedto = df_woassignedto[
           (df_woassignedto['WOID'] == woid) & 
-          (df_woassignedto['TDTLID'] == req_tdtl_code)
+          (df_woassignedto['TDTLID'] == req_tdtl_code) &
+          (df_woassignedto['STATUS'] == sqlite_db.ACTIVE_STATUS)
         ]  # Usa isin()
                
-        wo_assignedto_default_names = []  # Lista per i nomi predefiniti
-        for code in filtered_woassignedto["TDSPID"]: # Itero sui codici
-            name = servant.get_description_from_code(df_tdusers, code, "NAME")
-            wo_assignedto_default_names.append(name)
+        # Lista per i nomi predefiniti
+        wo_assignedto_default_names = servant.get_descriptions_from_codes(df_tdusers, filtered_woassignedto["TDSPID"], "NAME").tolist()
 
         wo_assignedto_option = list(df_tdusers["NAME"])
         wo_assignedto_title = ":orange[Tech Department Specialists assigned to](:red[*])"
@@ -334,15 +333,16 @@ def show_workorder_dialog(selected_row_dict,  # Passa un dizionario
             wo_idrow, success = sqlite_db.save_workorder(wo, conn)
             if success:
                 #st.write(f"{woid} - {req_tdtl_code} - {wo_assignedto}- {st.session_state.df_user} - {st.session_state.df_woassignedto}")
-                success = sqlite_db.save_workorder_assignments(woid, req_tdtl_code, wo_assignedto, st.session_state.df_users, st.session_state.df_woassignedto, conn)
-                success = sqlite_db.update_request(reqid, "ASSIGNED", req_note_td, "", [req_tdtl_code], conn)
+                user_codes = servant.get_code_lookup(st.session_state.df_users, "CODE", code_column="NAME")
+                df_assignments = sqlite_db.sync_workorder_assignments(woid, req_tdtl_code, user_codes.reindex(wo_assignedto).dropna().tolist(), conn)
+                success = sqlite_db.update_request(reqid, "ASSIGNED", req_note_td_default, "", [req_tdtl_code], conn)
                 if success:
                     st.session_state.grid_refresh = True
                     st.session_state.grid_response = None
                     st.success(f"Work order {woid} created successfully!")
-                    st.session_state.df_requests = sqlite_db.load_requests_data(conn)  # Ricarica i dati dal database
-                    st.session_state.df_workorders = sqlite_db.load_workorders_data(conn) 
-                    st.session_state.df_woassignedto = sqlite_db.load_woassignedto_data(conn) 
+                    sqlite_db.sync_session_data("df_requests", conn, [reqid])  # Ricarica solo le righe modificate
+                    sqlite_db.sync_session_data("df_workorders", conn, [woid])
+                    sqlite_db.merge_session_rows("df_woassignedto", df_assignments)
                     st.session_state.need_refresh = True
                     time.sleep(3)
                     reset_application_state()
@@ -355,24 +355,50 @@ def manage_request(conn):
 
     # Initialize session state
     sqlite_db.initialize_session_state(conn)
-    if "grid_data" not in st.session_state:
-        st.session_state.grid_data = st.session_state.df_requests.copy()
     if "grid_response" not in st.session_state:
         st.session_state.grid_response = None
     if "grid_refresh_key" not in st.session_state: 
         st.session_state.grid_refresh_key = "initial"    
 
+    # Sidebar controls - Filters
+    st.sidebar.header(":blue[Filters]")
+    status_filter = st.sidebar.selectbox(
+        ":orange[Status]", 
+        REQ_STATUS_OPTIONS, 
+        index=None,
+        key='Status_value'
+    )
+    
+    req_pline_options = st.session_state.df_pline['NAME'].sort_values()
+    pline_filter = st.sidebar.selectbox(
+        ":orange[Product Line]", 
+        req_pline_options, 
+        index=None,
+        key='Pline_value'
+    )
+    pline_filter_code = servant.get_code_from_name(st.session_state.df_pline, pline_filter, "CODE") if pline_filter else None
+
+    # Ordinamento eseguito dal database (la griglia mostra una sola pagina)
+    sort_by = st.sidebar.selectbox(":orange[Sort by]", list(sqlite_db.REQUESTS_GRID_COLUMNS), index=0, key="mr_sort_by")
+    sort_descending = st.sidebar.toggle("Descending", value=True, key="mr_sort_desc")
 
-    df_requests_grid = pd.DataFrame()
-    df_requests_grid['REQID'] = st.session_state.df_requests['REQID']
-    df_requests_grid['STATUS'] = st.session_state.df_requests['STATUS']
-    df_requests_grid['INSDATE'] = st.session_state.df_requests['INSDATE']#.dt.strftime('%d/%m/%Y')
-#    df_requests_grid['DEPTNAME'] = df_requests['DEPT'].apply(lambda dept_code: get_description_from_code(df_depts, dept_code, "NAME"))
-    df_requests_grid['PRIORITY'] = st.session_state.df_requests['PRIORITY']
+    # Apply filters: carica dal database solo la pagina visibile
+    page = servant.get_grid_page("mr_grid_page", (status_filter, pline_filter_code, sort_by, sort_descending))
+    df_page, total_rows = sqlite_db.load_requests_page(
+        conn, {"STATUS": status_filter, "PR_LINE": pline_filter_code}, sort_by, sort_descending, page
+    )
+    if df_page is None:
+        st.stop()
+    servant.clamp_grid_page("mr_grid_page", total_rows, sqlite_db.REQUESTS_PAGE_SIZE)
 
-    df_requests_grid['PRLINE_NAME'] = st.session_state.df_requests['PR_LINE'].apply(lambda pline_code: servant.get_description_from_code(st.session_state.df_pline, pline_code, "NAME"))
-    df_requests_grid['TITLE'] = st.session_state.df_requests['TITLE']
-    df_requests_grid['REQUESTER_NAME'] = st.session_state.df_requests['REQUESTER'].apply(lambda requester_code: servant.get_description_from_code(st.session_state.df_users, requester_code, "NAME"))
+    df_requests_grid = pd.DataFrame()
+    df_requests_grid['REQID'] = df_page['REQID']
+    df_requests_grid['STATUS'] = df_page['STATUS']
+    df_requests_grid['INSDATE'] = df_page['INSDATE'].dt.strftime('%Y-%m-%d')
+    df_requests_grid['PRIORITY'] = df_page['PRIORITY']
+    df_requests_grid['PRLINE_NAME'] = servant.get_descriptions_from_codes(st.session_state.df_pline, df_page['PR_LINE'], "NAME")
+    df_requests_grid['TITLE'] = df_page['TITLE']
+    df_requests_grid['REQUESTER_NAME'] = servant.get_descriptions_from_codes(st.session_state.df_users, df_page['REQUESTER'], "NAME")
 
     cellStyle = JsCode("""
         function(params) {
@@ -387,16 +413,15 @@ def manage_request(conn):
         }
         """)
     grid_builder = GridOptionsBuilder.from_dataframe(df_requests_grid)
-    # makes columns resizable, sortable and filterable by default
+    # makes columns resizable; sorting, filtering and paging are done in SQL
     grid_builder.configure_default_column(
         resizable=True,
-        filterable=True,
-        sortable=True,
+        filterable=False,
+        sortable=False,
         editable=False,
         enableRowGroup=False
     )
-    # Enalble pagination
-    grid_builder.configure_pagination(paginationAutoPageSize=False, paginationPageSize=12)
+    grid_builder.configure_pagination(enabled=False)
     grid_builder.configure_grid_options(domLayout='normal')
     grid_builder.configure_column("REQID", cellStyle=cellStyle)
     grid_builder.configure_selection(
@@ -408,66 +433,23 @@ def manage_request(conn):
     # List of available themes
     available_themes = ["streamlit", "alpine", "balham", "material"]
     
-    # Inizializzazione della sessione
-    if "grid_data" not in st.session_state:
-        st.session_state.grid_data = df_requests_grid.copy()  # Copia per evitare modifiche al DataFrame originale
-    if "grid_response" not in st.session_state:
-        st.session_state.grid_response = None
-
-
-    # Sidebar controls - Filters
-    st.sidebar.header(":blue[Filters]")
-    req_status_options = list(df_requests_grid['STATUS'].drop_duplicates().sort_values())
-    status_filter = st.sidebar.selectbox(
-        ":orange[Status]", 
-        req_status_options, 
-        index=None,
-        key='Status_value'
-    )
-    
-    req_pline_options = df_requests_grid['PRLINE_NAME'].drop_duplicates().sort_values()
-    pline_filter = st.sidebar.selectbox(
-        ":orange[Product Line]", 
-        req_pline_options, 
-        index=None,
-        key='Pline_value'
-    )
-
-    # Apply filters 
-    filtered_data = df_requests_grid.copy() 
-    if status_filter: 
-        filtered_data = filtered_data[filtered_data["STATUS"] == status_filter] 
-    if pline_filter: 
-        filtered_data = filtered_data[filtered_data["PRLINE_NAME"] == pline_filter] 
-    st.session_state.grid_data = filtered_data
+    st.session_state.grid_data = df_requests_grid
 
     # Display grid
     st.subheader(":orange[Request list]")
     
     # Creazione/Aggiornamento della griglia (UNA SOLA VOLTA per ciclo di esecuzione)
-    if st.session_state.grid_response is None:
-        st.session_state.grid_response = AgGrid(
-            st.session_state.grid_data,
-            gridOptions=grid_options,
-            allow_unsafe_jscode=True,
-            theme=available_themes[2],
-            fit_columns_on_grid_load=False,
-            update_mode=GridUpdateMode.MODEL_CHANGED,
-            data_return_mode=DataReturnMode.AS_INPUT,
-            key="main_grid"
-        )
-    else:
-        st.session_state.grid_response = AgGrid( # Aggiorna la griglia esistente
-            st.session_state.grid_data,
-            gridOptions=grid_options,
-            allow_unsafe_jscode=True,
-            theme=available_themes[2],
-            fit_columns_on_grid_load=False,
-            update_mode=GridUpdateMode.MODEL_CHANGED,
-            data_return_mode=DataReturnMode.AS_INPUT,
-            key="main_grid"
-        )
-
+    st.session_state.grid_response = AgGrid(
+        st.session_state.grid_data,
+        gridOptions=grid_options,
+        allow_unsafe_jscode=True,
+        theme=available_themes[2],
+        fit_columns_on_grid_load=False,
+        update_mode=GridUpdateMode.MODEL_CHANGED,
+        data_return_mode=DataReturnMode.AS_INPUT,
+        key="main_grid"
+    )
+    servant.show_grid_pager("mr_grid_page", total_rows, sqlite_db.REQUESTS_PAGE_SIZE)
 
     selected_rows = st.session_state.grid_response['selected_rows']
     modify_request_button_disable = not (selected_rows is not None and isinstance(selected_rows, pd.DataFrame) and not selected_rows.empty)
@@ -477,10 +459,11 @@ def manage_request(conn):
     col1, col2, col3 = st.columns(3)
     with col1:
         if st.button("🔄 Refresh data", type="secondary"):
+            sqlite_db.refresh_refdata(conn)
             reset_application_state()
-            st.session_state.df_requests = sqlite_db.load_requests_data(conn)  # Ricarica i dati dal database
-            st.session_state.df_workorders = sqlite_db.load_workorders_data(conn) 
-            st.session_state.df_woassignedto = sqlite_db.load_woassignedto_data(conn)             
+            sqlite_db.reload_session_data("df_requests", conn)  # Ricarica i dati dal database
+            sqlite_db.reload_session_data("df_workorders", conn)
+            sqlite_db.reload_session_data("df_woassignedto", conn)
     
     with col2:
         if st.button("✏️ Modify Request", type="secondary", disabled=modify_request_button_disable):
@@ -495,6 +478,6 @@ def manage_request(conn):
             if st.session_state.grid_response and st.session_state.grid_response['selected_rows'] is not None and not st.session_state.grid_response['selected_rows'].empty:
                 selected_rows_df = st.session_state.grid_response['selected_rows']
                 selected_row_dict = selected_rows_df.iloc[0].to_dict()  # oppure selected_rows_df.to_dict('records')[0]
-                show_workorder_dialog(selected_row_dict, st.session_state.df_workorders, st.session_state.df_woassignedto, st.session_state.df_users, STATUS_NEW, DEFAULT_DEPT_CODE, REQ_STATUS_OPTIONS, sqlite_db.save_workorder, sqlite_db.save_workorder_assignments, conn)
+                show_workorder_dialog(selected_row_dict, st.session_state.df_workorders, st.session_state.df_woassignedto, st.session_state.df_users, STATUS_NEW, DEFAULT_DEPT_CODE, REQ_STATUS_OPTIONS, sqlite_db.save_workorder, sqlite_db.sync_workorder_assignments, conn)
             # else:
             #     st.warning("Please select a request from the grid first.", icon="⚠️")  # Avvisa l'utent# ... (Resto del tuo codice)
\ No newline at end of file
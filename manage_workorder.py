@@ -46,6 +46,7 @@ def show_workitem_dialog(workorder_id, tdtl_id, conn):
     popup_title = f'Work Order {workorder_id}'  # Accedi a REQID direttamente
 
     @st.dialog(popup_title, width="large")
+    @sqlite_db.release_after(conn)
     def create_workitem_popup():
         with st.container(border=True ):
             
@@ -148,22 +149,15 @@ def manage_workorder(conn):
     if "df_workorders" not in st.session_state:
         st.session_state.df_workorders = sqlite_db.df_workorders(conn)
     if "wo_grid_data" not in st.session_state:
-        st.session_state.wo_grid_data = st.session_state.df_workorders.copy()
+        st.session_state.wo_grid_data = st.session_state.df_workorders
     
     #st.write("P01")
     #st.write(st.session_state.wo_grid_data)
 
     # Create display DataFrame
-    df_workorder_grid = pd.DataFrame({
-        'WOID': st.session_state.df_workorders['WOID'],
-        'INSDATE': pd.to_datetime(st.session_state.df_workorders['INSDATE']).dt.strftime('%d/%m/%Y'),
-        'TDTLID': st.session_state.df_workorders['TDTLID'],
-        'STATUS': st.session_state.df_workorders['STATUS'],
-        'SEQUENCE': st.session_state.df_workorders.get('SEQUENCE', None),  # Preserve SEQUENCE values
-        'TYPE': st.session_state.df_workorders['TYPE'],
-        'REQID': st.session_state.df_workorders['REQID'],
-        'TITLE': st.session_state.df_workorders['TITLE']
-    })
+    df_workorder_grid = st.session_state.df_workorders[
+        ['WOID', 'INSDATE', 'TDTLID', 'STATUS', 'SEQUENCE', 'TYPE', 'REQID', 'TITLE']
+    ].assign(INSDATE=st.session_state.df_workorders['INSDATE'].dt.strftime('%d/%m/%Y'))
 
     # Cell styling
     cellStyle = JsCode("""
@@ -196,17 +190,9 @@ def manage_workorder(conn):
             # Create a priority map for sorting (HIGH should be first)
             priority_map = {'HIGH': 1, 'LOW': 2}
             
-            # Create a temporary column for sorting
-            df = df.copy()
-            df['sort_priority'] = df['SEQUENCE'].map(lambda x: priority_map.get(x, 3))
-            
-            # Sort by priority
-            df = df.sort_values('sort_priority', ascending=True)
-            
-            # Remove temporary column
-            df = df.drop('sort_priority', axis=1)
-            
-            return df
+            # Sort by priority (rows are taken once, no temporary column)
+            sort_priority = df['SEQUENCE'].map(lambda x: priority_map.get(x, 3))
+            return df.iloc[sort_priority.argsort(kind="stable")]
         return df
 
     # Grid configuration
@@ -249,7 +235,7 @@ def manage_workorder(conn):
     )
 
     # Apply filters
-    filtered_data = df_workorder_grid.copy()
+    filtered_data = df_workorder_grid
     if status_filter:
         filtered_data = filtered_data[filtered_data["STATUS"] == status_filter]
     if tdtl_filter:
@@ -285,8 +271,9 @@ def manage_workorder(conn):
     col1, col2, col3 = st.columns(3)
     with col1:
         if st.button("🔄 Refresh data", type="secondary"):
-            st.session_state.df_workorders = sqlite_db.load_workorders_data(conn)
-            st.session_state.wo_grid_data = st.session_state.df_workorders.copy()
+            sqlite_db.refresh_refdata(conn)
+            sqlite_db.reload_session_data("df_workorders", conn)
+            st.session_state.wo_grid_data = st.session_state.df_workorders
             st.rerun()
 #            reset_application_state()
 #             st.session_state.df_workorders = sqlite_db.load_workorder_data(conn)  # Ricarica i dati dal database
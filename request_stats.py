@@ -0,0 +1,107 @@
+import pandas as pd
+import threading
+import time
+from datetime import date, timedelta
+from typing import Optional, Dict, List
+# Internal app module
+import sqlite_db
+
+# Dashboard aggregates are computed in SQL and shared by all sessions for one time bucket,
+# or until the data version of a source table moves (a write shows up at the next poll)
+STATS_BUCKET_SECONDS = 300
+
+_stats_cache = {}  # loader name -> ((bucket, versions), df)
+_stats_cache_lock = threading.Lock()
+_snapshot_stamp = None  # (bucket, versions) of the last daily snapshot written by this process
+_snapshot_lock = threading.Lock()
+
+
+def _get_stamp(conn, tables: List[str]) -> tuple:
+    """ Current time bucket and data versions of tables: a cached aggregate is valid while they match """
+
+    versions = sqlite_db.poll_data_versions(conn) or {}
+    return int(time.time() // STATS_BUCKET_SECONDS), tuple(versions.get(table, 0) for table in tables)
+
+
+def _get_bucketed(loader, conn, tables: List[str]) -> Optional[pd.DataFrame]:
+    """ Return loader(conn), computed at most once per bucket and version of tables by this process """
+
+    stamp = _get_stamp(conn, tables)
+    with _stats_cache_lock:
+        entry = _stats_cache.get(loader.__name__)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    df = loader(conn)
+    if df is not None:
+        with _stats_cache_lock:
+            _stats_cache[loader.__name__] = (stamp, df)
+    return df
+
+
+def get_request_counts(conn) -> Optional[pd.DataFrame]:
+    """ Return the request counts by STATUS, WEEK_YEAR, MONTH, PR_LINE and DEPT (COUNT column) """
+    return _get_bucketed(sqlite_db.load_request_counts_data, conn, ["TORP_REQUESTS"])
+
+
+def get_workorder_hours(conn) -> Optional[pd.DataFrame]:
+    """ Return the active workitem hours per work order (WOID, TIME_QTY) """
+    return _get_bucketed(sqlite_db.load_workorder_hours_data, conn, ["TORP_WORKITEMS"])
+
+
+def ensure_daily_snapshot(conn) -> None:
+    """ Refresh today's row set of TORP_STATS_DAILY, at most once per bucket and requests version per process """
+    global _snapshot_stamp
+
+    stamp = _get_stamp(conn, ["TORP_REQUESTS"])
+    # Held during the write: concurrent dashboards read the history only once it has landed
+    with _snapshot_lock:
+        if _snapshot_stamp == stamp:
+            return
+        if sqlite_db.save_status_snapshot(conn):
+            _snapshot_stamp = stamp  # A failed write is retried by the next call
+
+
+def get_status_deltas(conn) -> Dict[str, Dict[str, Optional[int]]]:
+    """ Return STATUS -> {"day": change since yesterday's snapshot, "week": change since the
+    snapshot of the same day a week ago} (None when that snapshot does not exist) """
+
+    ensure_daily_snapshot(conn)
+    df_history = _get_bucketed(sqlite_db.load_status_history_data, conn, ["TORP_REQUESTS"])
+    if df_history is None or df_history.empty:
+        return {}
+
+    totals = df_history.groupby(["SNAPDATE", "STATUS"])["COUNT"].sum().unstack(fill_value=0).sort_index()
+    today = date.today()
+    if today.isoformat() not in totals.index:
+        return {}
+    current = totals.loc[today.isoformat()]
+
+    def snapshot_of(day: date):
+        return totals.loc[day.isoformat()] if day.isoformat() in totals.index else None
+
+    previous_day = snapshot_of(today - timedelta(days=1))
+    previous_week = snapshot_of(today - timedelta(days=7))
+    return {
+        status: {
+            "day": int(count - previous_day[status]) if previous_day is not None else None,
+            "week": int(count - previous_week[status]) if previous_week is not None else None,
+        }
+        for status, count in current.items()
+    }
+
+
+def count_by(counts: pd.DataFrame, dimensions: List[str]) -> pd.DataFrame:
+    """ Roll the counts up to some dimensions, as a df with a COUNT column (chart-ready) """
+
+    if counts is None or counts.empty:
+        return pd.DataFrame(columns=dimensions + ["COUNT"])
+    return counts.groupby(dimensions, dropna=False)["COUNT"].sum().reset_index()
+
+
+def get_status_counts(counts: pd.DataFrame) -> Dict[str, int]:
+    """ Return STATUS -> number of requests """
+
+    if counts is None or counts.empty:
+        return {}
+    return counts.groupby("STATUS")["COUNT"].sum().to_dict()
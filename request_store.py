@@ -0,0 +1,59 @@
+import streamlit as st
+from typing import Optional, Dict, List
+# Internal app module
+import servant
+import sqlite_db
+
+
+def _name(df, code) -> str:
+    if df is None:
+        return ""
+    return servant.get_code_lookup(df, "NAME").get(code, "")
+
+
+def get_request_record(reqid: str, conn=None) -> Optional[Dict]:
+    """ Return one fully resolved request by REQID: request fields, decoded names,
+    assigned Team Leaders and attachment titles (None if the request is unknown).
+    With conn, a request not in df_requests yet is fetched and merged into it first """
+
+    df_requests = st.session_state.get("df_requests")
+    if (df_requests is None or reqid not in servant.get_row_index(df_requests, "REQID").index) and conn is not None:
+        # Rows of the SQL grid page can be newer than the session df (created here or by another user)
+        df_requests = sqlite_db.sync_session_data("df_requests", conn, [reqid])
+    if df_requests is None:
+        return None
+    requests = servant.get_row_index(df_requests, "REQID")
+    if reqid not in requests.index:
+        return None
+    record = requests.loc[reqid].to_dict()
+
+    record["DEPT_NAME"] = _name(st.session_state.get("df_depts"), record["DEPT"])
+    record["REQUESTER_NAME"] = _name(st.session_state.get("df_users"), record["REQUESTER"])
+    record["PRLINE_NAME"] = _name(st.session_state.get("df_pline"), record["PR_LINE"])
+    record["FAMILY_NAME"] = _name(st.session_state.get("df_pfamily"), record["PR_FAMILY"])
+    record["TYPE_NAME"] = _name(st.session_state.get("df_type"), record["TYPE"])
+    record["CATEGORY_NAME"] = _name(st.session_state.get("df_category"), record["CATEGORY"])
+    record["DETAIL_NAME"] = _name(st.session_state.get("df_detail"), record["DETAIL"])
+
+    record["TDTL_CODES"] = get_request_tdtl_codes(reqid)
+    record["TDTL_NAMES"] = [_name(st.session_state.get("df_users"), code) for code in record["TDTL_CODES"]]
+    record["ATTACHMENTS"] = get_request_attachment_titles(reqid)
+    return record
+
+
+def get_request_tdtl_codes(reqid: str) -> List[str]:
+    """ Return the codes of the Team Leaders actively assigned to a request """
+
+    df_reqassignedto = st.session_state.get("df_reqassignedto")
+    if df_reqassignedto is None:
+        return []
+    return list(servant.get_group_index(df_reqassignedto, "REQID", "TDTLID").get(reqid, []))
+
+
+def get_request_attachment_titles(reqid: str) -> List[str]:
+    """ Return the titles of the attachments of a request """
+
+    df_attachments = st.session_state.get("df_attachments")
+    if df_attachments is None:
+        return []
+    return list(servant.get_group_index(df_attachments, "REQID", "TITLE").get(reqid, []))
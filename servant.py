@@ -9,10 +9,14 @@ import re
 import os
 import pandas as pd
 import hmac
+import weakref
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 
+# Lookups and indexes built from a df, keyed by (id(df), kind, columns...)
+_df_index_cache = {}
+
 
 def get_code_from_name(df, name, code_column):
     result = df[df["NAME"] == name][code_column]
@@ -24,6 +28,140 @@ def get_description_from_code(df, code, description_column):
     return list(result)[0] if not result.empty else ""
 
 
+def _get_cached_for_df(df, cache_key, builder, depends=()):
+    """Return builder(df), computed once and reused while df (and the depends dfs it is
+    built from) are alive. Meant for dfs that are replaced, never modified in place, when
+    their data changes: the weak references tell a live df from a new one reusing its id."""
+    key = (id(df),) + tuple(id(d) for d in depends) + cache_key
+    entry = _df_index_cache.get(key)
+    if entry is not None and entry[0]() is df and all(ref() is d for ref, d in zip(entry[2], depends)):
+        return entry[1]
+
+    value = builder(df)
+    try:
+        drop = lambda _, key=key: _df_index_cache.pop(key, None)
+        df_ref = weakref.ref(df, drop)
+        depends_refs = [weakref.ref(d, drop) for d in depends]
+        _df_index_cache[key] = (df_ref, value, depends_refs)
+    except TypeError:
+        pass
+    return value
+
+
+def get_code_lookup(df, description_column, code_column="CODE"):
+    """Return a code -> description Series for df (first match wins, as in get_description_from_code)"""
+    return _get_cached_for_df(
+        df, ("lookup", code_column, description_column),
+        lambda d: d.drop_duplicates(code_column).set_index(code_column)[description_column]
+    )
+
+
+def get_row_index(df, key_column):
+    """Return df indexed by key_column (unique keys) for O(1) row access with .loc"""
+    return _get_cached_for_df(
+        df, ("rows", key_column),
+        lambda d: d.drop_duplicates(key_column).set_index(key_column, drop=False)
+    )
+
+
+def get_group_index(df, key_column, value_column):
+    """Return a dict key -> list of value_column values, for one-to-many tables"""
+    return _get_cached_for_df(
+        df, ("groups", key_column, value_column),
+        lambda d: d.groupby(key_column, sort=False, observed=True)[value_column].agg(list).to_dict()
+    )
+
+
+def get_descriptions_from_codes(df, codes, description_column):
+    """Vectorized get_description_from_code: resolve a whole Series of codes in one map"""
+    descriptions = codes.map(get_code_lookup(df, description_column))
+    return descriptions.astype(object).fillna("")  # A categorical result only accepts known categories
+
+
+def get_calendar_events(df_workitems, df_users, df_tskgrl1, df_tskgrl2, tdsp_code, window):
+    """Return the FullCalendar events and the event_key -> details dict of the workitems of
+    tdsp_code (all if None) in window (from, to dates), built with column operations and
+    reused until df_workitems (or a master data df) is replaced"""
+    return _get_cached_for_df(
+        df_workitems, ("calendar_events", tdsp_code, window),
+        lambda d: _build_calendar_events(d, df_users, df_tskgrl1, df_tskgrl2, tdsp_code, window),
+        depends=(df_users, df_tskgrl1, df_tskgrl2)
+    )
+
+
+def _build_calendar_events(df_workitems, df_users, df_tskgrl1, df_tskgrl2, tdsp_code, window):
+    df = df_workitems[df_workitems["TDSPID"] == tdsp_code] if tdsp_code else df_workitems
+    in_window = (df["REFDATE"] >= pd.Timestamp(window[0])) & (df["REFDATE"] < pd.Timestamp(window[1]) + pd.Timedelta(days=1))
+    df = df[in_window]
+    refdate = df["REFDATE"].dt.strftime('%Y-%m-%d')
+
+    tdsp_name = get_descriptions_from_codes(df_users, df["TDSPID"], "NAME")
+    event_key = df["WOID"].astype(str) + "_" + refdate + "_" + df["TDSPID"].astype(str)
+    active = df["STATUS"] == "ACTIVE"
+
+    events = pd.DataFrame({
+        "id": event_key,
+        "title": "[" + df["WOID"].astype(str) + "] - " + df["TIME_QTY"].astype(str) + " H - " + tdsp_name,
+        "start": refdate,
+        "backgroundColor": active.map({True: '#d4efdf', False: '#efd4d7'}),
+        "borderColor": active.map({True: '#a2d9ce', False: '#da9ca3'}),
+        "display": "block",
+    }).to_dict("records")
+
+    details = pd.DataFrame({
+        "woid": df["WOID"],
+        "tdspid": df["TDSPID"],
+        "tdsp_name": tdsp_name,
+        "status": df["STATUS"],
+        "time_qty": df["TIME_QTY"],
+        "time_um": df["TIME_UM"],
+        "tskgrl1": df["TSKGRL1"],
+        "tskgrl1_name": get_descriptions_from_codes(df_tskgrl1, df["TSKGRL1"], "NAME"),
+        "tskgrl2": df["TSKGRL2"],
+        "tskgrl2_name": get_descriptions_from_codes(df_tskgrl2, df["TSKGRL2"], "NAME"),
+        "description": df["DESC"],
+        "note": df["NOTE"],
+        "date": refdate,
+        "index": df.index,
+    }, index=df.index).to_dict("records")
+
+    return events, dict(zip(event_key, details))
+
+
+def get_grid_page(state_key, query_key):
+    """Return the current page of a paged grid, back to the first page when filters/sort change"""
+    if st.session_state.get(f"{state_key}_query") != query_key:
+        st.session_state[f"{state_key}_query"] = query_key
+        st.session_state[state_key] = 0
+    return st.session_state.get(state_key, 0)
+
+
+def clamp_grid_page(state_key, total_rows, page_size):
+    """Move a paged grid back to its last page when the current one is past the end"""
+    last_page = max((total_rows - 1) // page_size, 0)
+    if st.session_state.get(state_key, 0) > last_page:
+        st.session_state[state_key] = last_page
+        st.rerun()
+
+
+def show_grid_pager(state_key, total_rows, page_size):
+    """Show Prev/Next buttons and the page position of a paged grid"""
+    page = st.session_state.get(state_key, 0)
+    last_page = max((total_rows - 1) // page_size, 0)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("◀ Prev", key=f"{state_key}_prev", type="tertiary", disabled=page <= 0):
+            st.session_state[state_key] = page - 1
+            st.rerun()
+    with col2:
+        st.markdown(f"Page **{page + 1}** of **{last_page + 1}** - {total_rows} rows")
+    with col3:
+        if st.button("Next ▶", key=f"{state_key}_next", type="tertiary", disabled=page >= last_page):
+            st.session_state[state_key] = page + 1
+            st.rerun()
+
+
 def convert_df(df):
     df_clean = df.copy()
     df_clean["Column value"] = df_clean["Column value"].apply(remove_html_tags)
@@ -1,19 +1,158 @@
 import sqlitecloud
+import sqlite3
 import streamlit as st
 import pandas as pd
 from typing import Optional, Tuple, Dict, List
 import base64
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import time
+import threading
+import queue
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import db_pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Global constants
 ACTIVE_STATUS = "ACTIVE"
 DISABLED_STATUS = "DISABLED"
 DEFAULT_DEPT_CODE = "DTD"
 REQ_STATUS_OPTIONS = ['NEW', 'PENDING', 'ASSIGNED', 'WIP', 'COMPLETED', 'DELETED']
-
-def open_sqlitecloud_db():
-    """ Open a connection to SQLITE database"""
+REFDATA_CACHE_TTL = 600  # Seconds a cached master-data table stays valid
+VERSION_POLL_INTERVAL = 2  # Seconds a polled TORP_DATA_VERSION is reused by all sessions of the process
+HOT_TABLE_KEYS = ("df_requests", "df_workorders", "df_workitems")  # Kept materialized by the refresh worker
+HOT_REFRESH_INTERVAL = 5  # Seconds between two version polls of the refresh worker
+STATS_HISTORY_DAYS = 8  # Days of TORP_STATS_DAILY read for the dashboard deltas (day and week over week)
+WORKITEMS_WINDOWS_KEY = "workitems_windows"  # Session key of the date ranges loaded in df_workitems
+STARTUP_WORKERS = 3  # Max extra connections of one startup load (well below POOL_MAX_SIZE: no hold-and-wait)
+
+# Database backends
+DB_ENGINE_CLOUD = "sqlitecloud"
+DB_ENGINE_LOCAL = "sqlite3"
+SQLITE_PRAGMAS = {  # Applied to every local sqlite3 connection
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 268435456,  # 256 MB
+    "cache_size": -65536,  # 64 MB (negative = KiB)
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # ms
+}
+
+# Unique natural keys the ON CONFLICT upserts rely on: index name -> (table, key columns).
+# A missing index is built together with a dedupe of the table (latest row of each key kept)
+UNIQUE_KEYS = {
+    "IDX_REQASSIGNEDTO_KEY": ("TORP_REQASSIGNEDTO", ["reqid", "tdtlid"]),
+    "IDX_WOASSIGNEDTO_KEY": ("TORP_WOASSIGNEDTO", ["woid", "tdtlid", "tdspid"]),
+    "IDX_WORKORDERS_KEY": ("TORP_WORKORDERS", ["woid", "tdtlid"]),
+    "IDX_WORKITEMS_KEY": ("TORP_WORKITEMS", ["refdate", "woid", "tdspid"]),
+}
+
+# Other schema objects the data layer relies on, created once per process when missing
+SCHEMA_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS IDX_WORKITEMS_TDSP_REFDATE ON TORP_WORKITEMS (tdspid, refdate)",
+    """CREATE TABLE IF NOT EXISTS TORP_DATA_VERSION (
+        tablename TEXT NOT NULL PRIMARY KEY,
+        version INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS TORP_STATS_DAILY (
+        snapdate TEXT NOT NULL,
+        pline TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (snapdate, pline, status)
+    )""",
+]
+
+# Compact dtypes of the session dfs, applied at load time: repeated codes become
+# categoricals (one copy of each string) and dates datetime64 (parsed once here,
+# formatted only where they are displayed or written back). Quantities stay float64:
+# they are edited and written back, and float32 would turn 7.3 into 7.300000190734863
+DATE_DTYPE = "datetime64[ns]"
+QTY_DTYPE = "float64"
+TABLE_DTYPES = {
+    "TORP_REQUESTS": {
+        **dict.fromkeys(["STATUS", "DEPT", "USER", "PRIORITY", "PR_LINE", "PR_FAMILY", "TYPE", "CATEGORY", "DETAIL"], "category"),
+        "INSDATE": DATE_DTYPE,
+    },
+    "TORP_REQASSIGNEDTO": dict.fromkeys(["TDTLID", "STATUS", "USERNAME"], "category"),
+    "TORP_WORKORDERS": {
+        **dict.fromkeys(["TDTLID", "TYPE", "STATUS", "TIME_UM"], "category"),
+        **dict.fromkeys(["INSDATE", "STARTDATE", "ENDDATE"], DATE_DTYPE),
+        "TIME_QTY": QTY_DTYPE,
+    },
+    "TORP_WOASSIGNEDTO": dict.fromkeys(["WOID", "TDTLID", "TDSPID", "STATUS", "USERNAME"], "category"),
+    "TORP_WORKITEMS": {
+        **dict.fromkeys(["WOID", "TDSPID", "STATUS", "TSKGRL1", "TSKGRL2", "TIME_UM"], "category"),
+        "REFDATE": DATE_DTYPE,
+        "TIME_QTY": QTY_DTYPE,
+    },
+}
+
+# Upsert specs: natural key, columns written, columns set only on insert and the
+# function mapping a column to the key of the record dicts passed by the callers
+UPSERT_MAX_PARAMS = 999  # Host parameter limit of older SQLite builds
+UPSERT_SPECS = {
+    "TORP_WORKORDERS": {
+        "key": ["woid", "tdtlid"],
+        "columns": ["woid", "tdtlid", "type", "title", "description", "time_qty", "time_um",
+                    "status", "startdate", "enddate", "reqid", "insdate", "sequence"],
+        "insert_only": ["insdate"],
+        "field": str.lower,
+    },
+    "TORP_WORKITEMS": {
+        "key": ["refdate", "woid", "tdspid"],
+        "columns": ["refdate", "woid", "tdspid", "status", "tskgrl1", "tskgrl2",
+                    "description", "note", "time_qty", "time_um"],
+        "insert_only": ["time_um"],
+        "field": str.upper,
+    },
+}
+
+# Attachments
+ATTACHMENT_CHUNK_SIZE = 1048576  # Bytes read per query when streaming a BLOB (1 MB)
+ATTACHMENT_CACHE_MAX_BYTES = 67108864  # Attachment bytes kept in memory per process (64 MB)
+
+# Object numbering
+OBJID_BLOCK_SIZE = 10  # Request numbers reserved per round trip and handed out by this process
+
+# Process-wide connection pool, created on first use
+_pool = None
+_pool_lock = threading.Lock()
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+# Process-wide last poll of TORP_DATA_VERSION: (monotonic time, {table: version})
+_data_versions = None
+_data_versions_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# Process-wide snapshots of the hot tables: key -> {"version", "df", "hwm", "loaded_on"},
+# replaced as a whole by the refresh worker and shared read-only by all sessions
+_hot_snapshots = {}
+_hot_lock = threading.Lock()
+_hot_worker = None
+
+# Process-wide cache of master-data tables, shared read-only by all sessions
+_refdata_cache = {}
+_refdata_cache_lock = threading.Lock()
+_refdata_cache_stats = {"hits": 0, "misses": 0}
+
+# Process-wide LRU cache of attachment bytes (attachments are never modified once saved)
+_attachment_cache = OrderedDict()  # (reqid, rowid) -> bytes, least recently used first
+_attachment_cache_bytes = 0
+_attachment_cache_lock = threading.Lock()
+_attachment_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+# Process-wide blocks of reserved object numbers: (class, year, pline) -> [prefix, next prog, last prog]
+_objid_blocks = {}
+_objid_lock = threading.Lock()
+
+def get_db_credentials() -> Tuple[str, str]:
+    """ Return connection string and database name from ST.SECRETS """
     db_link = ""
     db_apikey = ""
     db_name = ""
@@ -25,34 +164,142 @@ def open_sqlitecloud_db():
         db_name = st.secrets["db_credentials"]["SQLITECLOUD_DBNAME"]
     except Exception as errMsg:
         st.error(f"**ERROR: DB credentials NOT FOUND: \n{errMsg}", icon="🚨")
-        rc = False
         
     conn_string = "".join([db_link, db_apikey])
+    return conn_string, db_name
+
+
+def get_db_settings() -> Dict[str, str]:
+    """ Return the database engine and its connection settings from ST.SECRETS.
+    The [db_backend] section is optional: ENGINE = "sqlite3" with SQLITE_PATH selects a local file,
+    otherwise SQLite Cloud is used with the [db_credentials] section. """
+    engine = DB_ENGINE_CLOUD
+    db_path = ""
+    try:
+        if "db_backend" in st.secrets:
+            engine = st.secrets["db_backend"].get("ENGINE", DB_ENGINE_CLOUD)
+            db_path = st.secrets["db_backend"].get("SQLITE_PATH", "")
+    except Exception as errMsg:
+        st.error(f"**ERROR reading DB backend settings: \n{errMsg}", icon="🚨")
+
+    if engine == DB_ENGINE_LOCAL:
+        return {"engine": engine, "conn_string": "", "db_name": db_path, "db_path": db_path}
+
+    conn_string, db_name = get_db_credentials()
+    return {"engine": DB_ENGINE_CLOUD, "conn_string": conn_string, "db_name": db_name, "db_path": ""}
+
+
+def connect_db(settings: Dict[str, str]):
+    """ Open a new connection with the configured engine """
+    if settings["engine"] == DB_ENGINE_LOCAL:
+        return connect_sqlite3(settings["db_path"])
+    return connect_sqlitecloud(settings["conn_string"], settings["db_name"])
+
+
+def connect_sqlite3(db_path: str) -> sqlite3.Connection:
+    """ Open a new connection to a local SQLite file in WAL mode with tuned pragmas """
+
+    # Pooled connections move between threads, but only one thread uses them at a time
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+def connect_sqlitecloud(conn_string: str, db_name: str):
+    """ Open a new connection to SQLite Cloud platform and select the database """
+
+    # Connect to SQLite Cloud platform
+    conn = sqlitecloud.connect(conn_string)
+    # Open SQLite database
+    conn.execute(f"USE DATABASE {db_name}")  
+    return conn
+
+
+def get_connection_pool() -> db_pool.ConnectionPool:
+    """ Return the process-wide connection pool, creating it on first use """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            settings = get_db_settings()
+            _pool = db_pool.ConnectionPool(lambda: connect_db(settings))
+        return _pool
+
+
+def get_pool_stats() -> Dict[str, float]:
+    """ Return size and wait metrics of the connection pool """
+    return get_connection_pool().stats()
+
+
+def ensure_schema(conn) -> None:
+    """ Create the UNIQUE_KEYS indexes (deduplicating their tables first) and SCHEMA_STATEMENTS
+    once per process. Raise on failure: the next connection retries, and until then no session
+    gets past open_sqlitecloud_db to write without the keys """
+    global _schema_checked
+
+    with _schema_lock:
+        if _schema_checked:
+            return
+        cursor = conn.cursor()
+        try:
+            for index, (table, columns) in UNIQUE_KEYS.items():
+                _ensure_unique_key(conn, cursor, index, table, columns)
+            for sql in SCHEMA_STATEMENTS:
+                cursor.execute(sql)
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        _schema_checked = True
+
+
+def _ensure_unique_key(conn, cursor, index: str, table: str, columns: List[str]) -> None:
+    """ Dedupe table on columns and build its unique index in one transaction, if the index is missing """
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+    if cursor.fetchone():
+        return
+    key_sql = ", ".join(columns)
+    cursor.execute("BEGIN")
+    cursor.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table} GROUP BY {key_sql})")
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({key_sql})")
+    conn.commit()
+
+
+def open_sqlitecloud_db():
+    """ Return the session handle on the connection pool (a connection is checked out on first use) """
 
     if 'conn' not in st.session_state:
+        settings = get_db_settings()
+        db_name = settings["db_name"]
+        conn = db_pool.PooledConnection(get_connection_pool())
+        cursor = None
         try:
-            # Connect to SQLite Cloud platform
-            conn = sqlitecloud.connect(conn_string)
             cursor = conn.cursor()
 
-            # Open SQLite database
-            conn.execute(f"USE DATABASE {db_name}")  
-
             # Get Sqlite Cloud database version
             cursor.execute("SELECT sqlite_version();")
             #st.success(f"Connect to SQLITE CLOUD version {cursor.fetchone()}")
             sqlite_version = cursor.fetchone()
             #st.write(f"{type(sqlite_version)} - {sqlite_version}" )
 
+            # Before the handle is stored: a failed schema check is retried on the next run
+            ensure_schema(conn)
+
             if conn:
                 st.session_state.conn = conn
             if sqlite_version:    
                 st.session_state.sqlite_version = sqlite_version[0]
             if db_name:
                 st.session_state.dbname = db_name
+            st.session_state.db_engine = settings["engine"]
 
         except Exception as errMsg:
             st.error(f"**ERROR connecting to database: \n{errMsg}", icon="🚨")
+            conn.release(broken=True)
             return None
         
         finally: 
@@ -64,6 +311,27 @@ def open_sqlitecloud_db():
         return st.session_state["conn"]
 
 
+def release_sqlitecloud_db(conn) -> None:
+    """ Give the session connection back to the pool at the end of a page run """
+    if conn:
+        conn.release()
+
+
+def release_after(conn):
+    """ Decorator for st.dialog bodies: their reruns skip the page's final release,
+    so give the session connection back whenever the body returns (or reruns) """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                release_sqlitecloud_db(conn)
+        return wrapper
+    return decorator
+
+
 def close_sqlitecloud_db(conn):
     with st.container(border=True):
         try:  
@@ -310,11 +578,25 @@ def load_permission_data(conn):
     return df_permission
 
 
-def load_requests_data(conn):
-    """ Load TORP_REQUESTS records into df """    
+def apply_column_dtypes(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """ Cast the columns of a table df to their compact TABLE_DTYPES dtype """
+
+    dtypes = {
+        column: dtype for column, dtype in TABLE_DTYPES.get(table, {}).items()
+        if column in df.columns and df[column].dtype != dtype
+    }
+    if not dtypes:
+        return df
+    dates = {column: pd.to_datetime(df[column], errors="coerce") for column, dtype in dtypes.items() if dtype == DATE_DTYPE}
+    return df.astype({column: dtype for column, dtype in dtypes.items() if dtype != DATE_DTYPE}).assign(**dates)
+
+
+def load_requests_data(conn, condition: str = "", params: tuple = ()):
+    """ Load TORP_REQUESTS records into df (optionally only rows matching condition) """    
 
+    where_sql = f"WHERE {condition}" if condition else ""
     try:
-        df_requests = pd.read_sql_query("""
+        df_requests = pd.read_sql_query(f"""
         SELECT 
             A.reqid AS REQID, 
             A.status AS STATUS, 
@@ -333,16 +615,78 @@ def load_requests_data(conn):
             A.note_td AS NOTE_TD, 
             A.woid AS WOID  
         FROM TORP_REQUESTS A
+        {where_sql}
         ORDER by REQID desc
-        """, conn)
-        df_requests["INSDATE"] = pd.to_datetime(df_requests["INSDATE"])
-        df_requests["INSDATE"] = df_requests["INSDATE"].dt.strftime('%Y-%m-%d')
+        """, conn, params=params)
+        df_requests = apply_column_dtypes(df_requests, "TORP_REQUESTS")
     except Exception as errMsg:
         st.error(f"**ERROR load data from TORP_REQUESTS: \n{errMsg}", icon="🚨")
         return None
     
     return df_requests
 
+# Request grid: sortable/filterable columns and the SQL expressions behind them
+REQUESTS_PAGE_SIZE = 12
+REQUESTS_GRID_COLUMNS = {
+    "REQID": "A.reqid",
+    "STATUS": "A.status",
+    "INSDATE": "A.insdate",
+    "PRIORITY": "A.priority",
+    "PR_LINE": "A.pline",
+    "TITLE": "A.title",
+    "REQUESTER": "A.requester",
+}
+
+def load_requests_page(conn, filters: dict = None, sort_by: str = "REQID", descending: bool = True,
+                       page: int = 0, page_size: int = REQUESTS_PAGE_SIZE) -> Tuple[Optional[pd.DataFrame], int]:
+    """ Load one page of TORP_REQUESTS for the request grid, filtered and sorted in SQL.
+    filters maps grid columns (see REQUESTS_GRID_COLUMNS) to the value they must equal.
+    Return the page df and the total number of matching rows. """
+
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        if value is not None and value != "":
+            conditions.append(f"{REQUESTS_GRID_COLUMNS[column]} = ?")
+            params.append(value)
+    where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+    direction = "DESC" if descending else "ASC"
+    order_sql = f"{REQUESTS_GRID_COLUMNS[sort_by]} {direction}, A.reqid DESC"
+
+    try:
+        df_page = pd.read_sql_query(f"""
+        SELECT 
+            A.reqid AS REQID, 
+            A.status AS STATUS, 
+            A.insdate AS INSDATE, 
+            A.priority AS PRIORITY, 
+            A.pline AS PR_LINE, 
+            A.title AS TITLE, 
+            A.requester AS REQUESTER,
+            COUNT(*) OVER () AS TOTAL_ROWS
+        FROM TORP_REQUESTS A
+        {where_sql}
+        ORDER BY {order_sql}
+        LIMIT ? OFFSET ?
+        """, conn, params=tuple(params) + (page_size, page * page_size))
+        df_page["INSDATE"] = pd.to_datetime(df_page["INSDATE"], errors="coerce")
+        if not df_page.empty:
+            total_rows = int(df_page["TOTAL_ROWS"].iloc[0])
+        elif page > 0:
+            # Past the last page (rows left the filter): the window count has no row to ride on
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM TORP_REQUESTS A {where_sql}", tuple(params))
+            total_rows = cursor.fetchone()[0]
+            cursor.close()
+        else:
+            total_rows = 0
+    except Exception as errMsg:
+        st.error(f"**ERROR load data from TORP_REQUESTS: \n{errMsg}", icon="🚨")
+        return None, 0
+
+    return df_page.drop(columns=["TOTAL_ROWS"]), total_rows
+
+
 def load_reqassignedto_data(conn):
     """ Load TORP_REQASSIGNEDTO records into df """    
 
@@ -358,6 +702,7 @@ def load_reqassignedto_data(conn):
         WHERE A.status = 'ACTIVE'
         ORDER BY REQID desc
         """, conn)
+        df_reqassignedto = apply_column_dtypes(df_reqassignedto, "TORP_REQASSIGNEDTO")
     except Exception as errMsg:
         st.error(f"**ERROR load data from TORP_REQASSIGNEDTO: \n{errMsg}", icon="🚨")
         return None
@@ -384,11 +729,12 @@ def load_attachments_data(conn):
     return df_attachments
 
 
-def load_workorders_data(conn):
-    """ Load TORP_WORKORDERS records into df """
+def load_workorders_data(conn, condition: str = "", params: tuple = ()):
+    """ Load TORP_WORKORDERS records into df (optionally only rows matching condition) """
 
+    where_sql = f"WHERE {condition}" if condition else ""
     try:
-        df_workorders = pd.read_sql_query("""
+        df_workorders = pd.read_sql_query(f"""
         SELECT 
             A.woid AS WOID,
             A.insdate AS INSDATE,
@@ -404,20 +750,21 @@ def load_workorders_data(conn):
             A.enddate AS ENDDATE,                                       
             A.reqid AS REQID
         FROM TORP_WORKORDERS A
+        {where_sql}
         ORDER BY REQID
-        """, conn)
-        df_workorders["INSDATE"] = pd.to_datetime(df_workorders["INSDATE"])
-        df_workorders["INSDATE"] = df_workorders["INSDATE"].dt.strftime('%Y-%m-%d')
+        """, conn, params=params)
+        df_workorders = apply_column_dtypes(df_workorders, "TORP_WORKORDERS")
     except Exception as errMsg:
         st.error(f"**ERROR load data from TORP_WORKORDERS: \n{errMsg}", icon="🚨")
         return None
     return df_workorders
 
-def load_woassignedto_data(conn):
-    """ Load TORP_WOASSIGNEDTO records into df """
+def load_woassignedto_data(conn, condition: str = "", params: tuple = ()):
+    """ Load TORP_WOASSIGNEDTO records into df (optionally only rows matching condition) """
        
+    and_sql = f"AND ({condition})" if condition else ""
     try:
-        df_woassignedto = pd.read_sql_query("""
+        df_woassignedto = pd.read_sql_query(f"""
         SELECT 
             A.woid AS WOID, 
             A.tdtlid AS TDTLID,
@@ -426,21 +773,24 @@ def load_woassignedto_data(conn):
             B.name AS USERNAME 
         FROM TORP_WOASSIGNEDTO A
         INNER JOIN TORP_USERS B ON B.code = A.tdtlid    
-        WHERE A.status = 'ACTIVE'
-        OR A.status = 'DISABLED'
+        WHERE (A.status = 'ACTIVE'
+        OR A.status = 'DISABLED')
+        {and_sql}
         ORDER BY WOID
-        """, conn)    
+        """, conn, params=params)
+        df_woassignedto = apply_column_dtypes(df_woassignedto, "TORP_WOASSIGNEDTO")
     except Exception as errMsg:
         st.error(f"**ERROR load data from TORP_WOASSIGNEDTO: \n{errMsg}", icon="🚨")
         return None
     return df_woassignedto
 
 
-def load_workitems_data(conn):
-    """ Load TORP_TORP_WORKITEMS records into df """
+def load_workitems_data(conn, condition: str = "", params: tuple = ()):
+    """ Load TORP_TORP_WORKITEMS records into df (optionally only rows matching condition) """
        
+    where_sql = f"WHERE {condition}" if condition else ""
     try:
-        df_workitem = pd.read_sql_query("""
+        df_workitem = pd.read_sql_query(f"""
         SELECT 
             A.refdate AS REFDATE, 
             A.woid AS WOID, 
@@ -453,236 +803,677 @@ def load_workitems_data(conn):
             A.time_qty AS TIME_QTY,
             A.time_um AS TIME_UM
         FROM TORP_WORKITEMS A  
+        {where_sql}
         ORDER BY WOID
-        """, conn)
-        df_workitem['REFDATE'] = pd.to_datetime(df_workitem['REFDATE']) 
-        df_workitem["REFDATE"] = df_workitem["REFDATE"].dt.strftime('%Y-%m-%d')        
+        """, conn, params=params)
+        df_workitem = apply_column_dtypes(df_workitem, "TORP_WORKITEMS")
     except Exception as errMsg:
         st.error(f"**ERROR load data from TORP_WORKITEMS: \n{errMsg}", icon="🚨")
         return None
     return df_workitem
 
 
-def get_next_object_id(obj_class, obj_year, obj_pline, obj_parent, conn) -> str:
+def get_default_workitems_window() -> Tuple[date, date]:
+    """ Date range of df_workitems at startup: previous and current month (the calendar's range) """
+
+    first_day_current_month = date.today().replace(day=1)
+    first_day_previous_month = (first_day_current_month - timedelta(days=1)).replace(day=1)
+    last_day_current_month = (first_day_current_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first_day_previous_month, last_day_current_month
+
+
+def _workitems_window_condition(ranges: List[Tuple[date, date]], tdspid: Optional[str] = None) -> Tuple[str, tuple]:
+    """ SQL predicate for workitems in any of the (inclusive) date ranges, optionally of one specialist """
+
+    condition = " OR ".join(["(A.refdate >= ? AND A.refdate < ?)"] * len(ranges))
+    params = [value for start, end in ranges for value in (start.isoformat(), (end + timedelta(days=1)).isoformat())]
+    if tdspid:
+        return f"A.tdspid = ? AND ({condition})", (tdspid, *params)
+    return condition, tuple(params)
+
+
+def load_workitems_window(conn, date_from: date, date_to: date, tdspid: Optional[str] = None):
+    """ Load the TORP_WORKITEMS records of a date range (and specialist), filtered in SQL """
+
+    condition, params = _workitems_window_condition([(date_from, date_to)], tdspid)
+    return load_workitems_data(conn, condition, params)
+
+
+def load_default_workitems_data(conn, condition: str = "", params: tuple = ()):
+    """ Session loader of df_workitems: the default window only (a condition is a delta sync and passes through) """
+
+    if condition:
+        return load_workitems_data(conn, condition, params)
+    return load_workitems_window(conn, *get_default_workitems_window())
+
+
+def _missing_ranges(ranges: List[Tuple[date, date]], date_from: date, date_to: date) -> List[Tuple[date, date]]:
+    """ Parts of [date_from, date_to] not covered by ranges """
+
+    missing = []
+    start = date_from
+    for range_from, range_to in sorted(ranges):
+        if range_to < start:
+            continue
+        if range_from > date_to:
+            break
+        if range_from > start:
+            missing.append((start, range_from - timedelta(days=1)))
+        start = max(start, range_to + timedelta(days=1))
+    if start <= date_to:
+        missing.append((start, date_to))
+    return missing
+
+
+def _merge_ranges(ranges: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    merged = []
+    for range_from, range_to in sorted(ranges):
+        if merged and range_from <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_to))
+        else:
+            merged.append((range_from, range_to))
+    return merged
+
+
+def ensure_workitems_window(conn, date_from: date, date_to: date, tdspid: Optional[str] = None):
+    """ Make sure df_workitems holds the workitems of [date_from, date_to] (of tdspid, or of everybody):
+    only the days not loaded yet are read from the database and merged in """
+
+    if "df_workitems" not in st.session_state or date_from > date_to:
+        return st.session_state.get("df_workitems")
+    if WORKITEMS_WINDOWS_KEY not in st.session_state:
+        st.session_state[WORKITEMS_WINDOWS_KEY] = {"*": [get_default_workitems_window()]}
+    windows = st.session_state[WORKITEMS_WINDOWS_KEY]
+
+    scope = tdspid or "*"
+    covered = windows.get("*", []) + (windows.get(scope, []) if scope != "*" else [])
+    missing = _missing_ranges(covered, date_from, date_to)
+    if not missing:
+        return st.session_state.df_workitems
+
+    condition, params = _workitems_window_condition(missing, tdspid)
+    df_rows = load_workitems_data(conn, condition, params)
+    if df_rows is None:
+        return st.session_state.df_workitems
+
+    df_current = st.session_state.df_workitems
+    st.session_state.df_workitems = df_rows if df_current is None else _merge_rows("df_workitems", df_current, df_rows)
+    windows[scope] = _merge_ranges(windows.get(scope, []) + missing)
+    return st.session_state.df_workitems
+
+
+def load_request_counts_data(conn):
+    """ Load the number of TORP_REQUESTS by status, week, month, product line and department """
+
+    try:
+        df_counts = pd.read_sql_query("""
+        SELECT 
+            A.status AS STATUS, 
+            strftime('%Y-%W', A.insdate) AS WEEK_YEAR, 
+            strftime('%Y-%m', A.insdate) AS MONTH, 
+            A.pline AS PR_LINE, 
+            A.dept AS DEPT, 
+            COUNT(*) AS COUNT
+        FROM TORP_REQUESTS A
+        GROUP BY 1, 2, 3, 4, 5
+        """, conn)
+    except Exception as errMsg:
+        st.error(f"**ERROR load request counts from TORP_REQUESTS: \n{errMsg}", icon="🚨")
+        return None
+    return df_counts
+
+
+def load_workorder_hours_data(conn):
+    """ Load the hours of the active TORP_WORKITEMS per work order """
+
+    try:
+        df_hours = pd.read_sql_query("""
+        SELECT 
+            A.woid AS WOID, 
+            SUM(A.time_qty) AS TIME_QTY
+        FROM TORP_WORKITEMS A
+        WHERE A.status = 'ACTIVE'
+        GROUP BY A.woid
+        ORDER BY TIME_QTY DESC
+        """, conn)
+    except Exception as errMsg:
+        st.error(f"**ERROR load workitem hours from TORP_WORKITEMS: \n{errMsg}", icon="🚨")
+        return None
+    return df_hours
+
+
+def save_status_snapshot(conn, snapdate: Optional[date] = None) -> bool:
+    """ Write the current number of requests per product line and status as the snapshot of
+    snapdate (default today) in TORP_STATS_DAILY, replacing the rows already written for that day """
+
+    snapdate = (snapdate or date.today()).isoformat()
+    try:
+        with unit_of_work(conn) as cursor:
+            cursor.execute("DELETE FROM TORP_STATS_DAILY WHERE snapdate = ?", (snapdate,))
+            cursor.execute("""
+                INSERT INTO TORP_STATS_DAILY (snapdate, pline, status, count)
+                SELECT ?, COALESCE(A.pline, ''), A.status, COUNT(*)
+                FROM TORP_REQUESTS A
+                GROUP BY 2, 3
+                """, (snapdate,))
+    except Exception as errMsg:
+        st.error(f"**ERROR saving snapshot in TORP_STATS_DAILY: \n{errMsg}", icon="🚨")
+        return False
+    return True
+
+
+def load_status_history_data(conn, days: int = STATS_HISTORY_DAYS):
+    """ Load the TORP_STATS_DAILY snapshots of the last days """
+
+    date_from = (date.today() - timedelta(days=days)).isoformat()
+    try:
+        df_history = pd.read_sql_query("""
+        SELECT 
+            A.snapdate AS SNAPDATE, 
+            A.pline AS PR_LINE, 
+            A.status AS STATUS, 
+            A.count AS COUNT
+        FROM TORP_STATS_DAILY A
+        WHERE A.snapdate >= ?
+        ORDER BY SNAPDATE
+        """, conn, params=(date_from,))
+    except Exception as errMsg:
+        st.error(f"**ERROR load data from TORP_STATS_DAILY: \n{errMsg}", icon="🚨")
+        return None
+    return df_history
+
+
+# Delta sync specs for the transactional dfs: source table, loader, primary key
+# of the df, columns matching a "changed key" and the loader's sort order
+SYNC_TABLES = {
+    'df_requests': {
+        "table": "TORP_REQUESTS",
+        "loader": load_requests_data,
+        "pk": ["REQID"],
+        "change_columns": ["A.reqid"],
+        "order": (["REQID"], [False]),
+    },
+    'df_workorders': {
+        "table": "TORP_WORKORDERS",
+        "loader": load_workorders_data,
+        "pk": ["WOID", "TDTLID"],
+        "change_columns": ["A.woid"],
+        "order": (["REQID"], [True]),
+    },
+    'df_woassignedto': {
+        "table": "TORP_WOASSIGNEDTO",
+        "loader": load_woassignedto_data,
+        "pk": ["WOID", "TDTLID", "TDSPID"],
+        "change_columns": ["A.woid"],
+        "order": (["WOID"], [True]),
+    },
+    'df_workitems': {
+        "table": "TORP_WORKITEMS",
+        "loader": load_default_workitems_data,
+        "pk": ["REFDATE", "WOID", "TDSPID"],
+        "change_columns": ["A.refdate", "A.woid", "A.tdspid"],
+        "order": (["WOID"], [True]),
+        "windows_key": WORKITEMS_WINDOWS_KEY,
+    },
+}
+
+
+def get_max_rowid(table: str, conn) -> Optional[int]:
+    """ Return the highest rowid of a table (None if not available) """
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT MAX(rowid) FROM {table}")
+        result = cursor.fetchone()
+    except Exception:
+        return None
+    finally:
+        if cursor:
+            cursor.close() # Close the cursor in a finally block
+    if result and result[0] is not None:
+        return int(result[0])
+    return 0
+
+
+def reload_session_data(key: str, conn):
+    """ Full reload of a synced df into session state, recording its rowid high-water mark """
+
+    spec = SYNC_TABLES[key]
+    if "sync_hwm" not in st.session_state:
+        st.session_state.sync_hwm = {}
+
+    # Read the mark *before* the load: rows inserted in between are fetched twice, never lost
+    st.session_state.sync_hwm[key] = get_max_rowid(spec["table"], conn)
+    st.session_state[key] = spec["loader"](conn)
+    if "windows_key" in spec:
+        st.session_state.pop(spec["windows_key"], None)  # Back to the loader's default window
+    return st.session_state[key]
+
+
+def sync_session_data(key: str, conn, changed_keys: list = None):
+    """ Incremental refresh of a synced df: fetch rows inserted since the last sync
+    (rowid high-water mark) plus the rows of changed_keys, and merge them by primary key """
+
+    spec = SYNC_TABLES[key]
+    df_current = st.session_state.get(key)
+    last_hwm = st.session_state.get("sync_hwm", {}).get(key)
+    if df_current is None or last_hwm is None:
+        return reload_session_data(key, conn)
+
+    new_hwm = get_max_rowid(spec["table"], conn)
+    if new_hwm is None:
+        return reload_session_data(key, conn)
+
+    conditions = ["A.rowid > ?"]
+    params = [last_hwm]
+    for changed_key in changed_keys or []:
+        if not isinstance(changed_key, (tuple, list)):
+            changed_key = (changed_key,)
+        conditions.append("(" + " AND ".join(f"{col} = ?" for col in spec["change_columns"]) + ")")
+        params.extend(changed_key)
+
+    if new_hwm == last_hwm and len(conditions) == 1:
+        return df_current  # Nothing inserted and nothing touched
+
+    df_delta = spec["loader"](conn, " OR ".join(conditions), tuple(params))
+    if df_delta is None:
+        return reload_session_data(key, conn)
+
+    df_current = _merge_rows(key, df_current, df_delta)
+    st.session_state.sync_hwm[key] = max(new_hwm, last_hwm)
+    st.session_state[key] = df_current
+    if changed_keys:
+        # Only a sync given the keys just written has fetched the updated rows for sure
+        # (the rowid mark sees inserts only): otherwise the version bus reloads the df
+        _acknowledge_own_write(spec["table"])
+    return df_current
+
+
+def _merge_rows(key: str, df_current: pd.DataFrame, df_rows: pd.DataFrame) -> pd.DataFrame:
+    """ Replace/add df_rows in df_current by the primary key of the synced df """
+
+    if df_rows.empty:
+        return df_current
+    spec = SYNC_TABLES[key]
+    df_rows = apply_column_dtypes(df_rows, spec["table"])  # Rows built by the callers carry date strings
+    pk = spec["pk"]
+    replaced = df_current.set_index(pk).index.isin(df_rows.set_index(pk).index)
+    sort_by, ascending = spec["order"]
+    df_merged = pd.concat([df_current[~replaced], df_rows], ignore_index=True)
+    # concat falls back to object for categoricals with different categories
+    df_merged = apply_column_dtypes(df_merged, spec["table"])
+    return df_merged.sort_values(sort_by, ascending=ascending, kind="stable").reset_index(drop=True)
+
+
+def merge_session_rows(key: str, df_rows: pd.DataFrame):
+    """ Merge rows just written by the caller into a synced df, without querying the database """
+
+    df_current = st.session_state.get(key)
+    if df_current is None or df_rows is None:
+        return df_current
+    st.session_state[key] = _merge_rows(key, df_current, df_rows)
+    _acknowledge_own_write(SYNC_TABLES[key]["table"])
+    return st.session_state[key]
+
+
+@contextmanager
+def unit_of_work(conn, tables: Optional[List[str]] = None, mergeable: bool = True):
+    """ Run a group of writes as one transaction: yields a cursor, commits once at the end
+    and rolls everything back if any statement fails. The data versions of `tables` are
+    bumped in the same transaction, so other sessions see the change on their next poll.
+    mergeable=False (hard deletes, which a merge cannot replay) keeps the session from
+    acknowledging its own version, so the version bus reloads the tables instead """
+
+    versions = {}
+    pooled = isinstance(conn, db_pool.PooledConnection)
+    if pooled:
+        conn.pin()  # An idle-lease reclaim must not take the connection mid-transaction
+    cursor = conn.cursor()
+    try:
+        if not getattr(conn, "in_transaction", False):
+            cursor.execute("BEGIN")
+        yield cursor
+        if tables:
+            versions = _bump_data_versions(cursor, tables)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        if pooled:
+            conn.unpin()
+    if mergeable:
+        _record_own_writes(versions)
+
+
+def _bump_data_versions(cursor, tables: List[str]) -> Dict[str, int]:
+    values_sql = ", ".join(["(?, 1)"] * len(tables))
+    cursor.execute(
+        f"""
+        INSERT INTO TORP_DATA_VERSION (tablename, version) VALUES {values_sql}
+        ON CONFLICT (tablename) DO UPDATE SET version = version + 1
+        RETURNING tablename, version
+        """,
+        tables
+    )
+    return dict(cursor.fetchall())
+
+
+def _record_own_writes(versions: Dict[str, int]) -> None:
+    """ Remember the versions created by this session's own writes (see _acknowledge_own_write) """
+
+    if versions and get_script_run_ctx() is not None:
+        st.session_state.setdefault("own_data_versions", {}).update(versions)
+
+
+def _acknowledge_own_write(table: str) -> None:
+    """ Called after a session merged its own change: if nobody else wrote the table in
+    between, its version is up to date and no reload is needed """
+
+    own_version = st.session_state.get("own_data_versions", {}).get(table)
+    seen = st.session_state.get("data_versions")
+    if own_version is not None and seen is not None and seen.get(table, 0) == own_version - 1:
+        seen[table] = own_version
+
+
+def poll_data_versions(conn, max_age: float = VERSION_POLL_INTERVAL) -> Optional[Dict[str, int]]:
+    """ Return {table: version} of TORP_DATA_VERSION, polled at most once per max_age seconds by the process """
+    global _data_versions
+
+    with _data_versions_lock:
+        if _data_versions is not None and time.monotonic() - _data_versions[0] < max_age:
+            return _data_versions[1]
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tablename, version FROM TORP_DATA_VERSION")
+        versions = dict(cursor.fetchall())
+    except Exception:
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+    with _data_versions_lock:
+        _data_versions = (time.monotonic(), versions)
+    return versions
+
+
+def _insert_attachments(cursor, req_id: str, attachments_list: list) -> None:
+    sql = """
+        INSERT INTO TORP_ATTACHMENTS (class, title, link, data, reqid)
+        VALUES (?, ?, ?, ?, ?)
+    """
+    cursor.executemany(sql, [
+        (attachment["class_type"], attachment["title"], attachment["link"], attachment["file_content"], req_id)
+        for attachment in attachments_list
+    ])
+
+
+def _reserve_object_ids(obj_class: str, obj_year: str, obj_pline: str, count: int, conn) -> Tuple[str, int]:
+    """ Atomically reserve `count` numbers in TORP_OBJNUMERATOR and return (prefix, last reserved prog) """
+
+    sql_reserve = """
+        UPDATE TORP_OBJNUMERATOR SET prog = prog + ?
+        WHERE obj_class=? and obj_year=? and obj_pline=?
+        RETURNING prefix, prog
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql_reserve, (count, obj_class, obj_year, obj_pline))
+        row = cursor.fetchone()
+        if row is None:
+            # First number of the year: create the counter (only once, even with concurrent callers) and retry
+            cursor.execute(
+                """
+                INSERT INTO TORP_OBJNUMERATOR (obj_class, obj_year, obj_pline, prefix, prog)
+                SELECT ?, ?, ?, ?, 0
+                WHERE NOT EXISTS (SELECT 1 FROM TORP_OBJNUMERATOR WHERE obj_class=? and obj_year=? and obj_pline=?)
+                """,
+                (obj_class, obj_year, obj_pline, obj_class[0], obj_class, obj_year, obj_pline)
+            )
+            cursor.execute(sql_reserve, (count, obj_class, obj_year, obj_pline))
+            row = cursor.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return row[0], int(row[1])
+
+
+def get_next_object_id(obj_class, obj_year, obj_pline, obj_parent, conn, block_size: int = OBJID_BLOCK_SIZE) -> str:
     """Get next available row ID"""
 
     ZERO_PADDING_NR = 4
     SEP_CHAR = '-'
     WO_PREFIX = "W"
-    next_rowid = ""
 
     # Work Order numeration-> Prefix + numeration of Request
     if obj_class == "WOR": 
-        next_rowid = WO_PREFIX + obj_parent[1:]
+        return WO_PREFIX + obj_parent[1:]
     
-    # Request numeration
+    # Request numeration: numbers come from a block reserved in one statement and are
+    # handed out by this process until it runs out (numbers left at shutdown are skipped)
     if obj_class == "REQ":    
-        try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT prefix AS PREFIX, prog AS PROG FROM TORP_OBJNUMERATOR WHERE obj_class=? and obj_year=? and obj_pline=?', (obj_class, obj_year, obj_pline))
-            results = cursor.fetchone()
-            if results:
-                prefix = results[0]
-                next_prog = int(results[1]) + 1
-                next_rowid = prefix + obj_year[2:4] + SEP_CHAR + str(next_prog).zfill(ZERO_PADDING_NR)
-                cursor.execute(
-                    "UPDATE TORP_OBJNUMERATOR SET prog = ? WHERE obj_class=? and obj_year=? and obj_pline=?",
-                    (next_prog, obj_class, obj_year, obj_pline)
-                )               
-            else:        
-                prefix = obj_class[0]
-                next_prog = 1
-                next_rowid = prefix + obj_year[2:4] + SEP_CHAR + str(next_prog).zfill(ZERO_PADDING_NR)
-                cursor.execute(
-                    "INSERT INTO TORP_OBJNUMERATOR (obj_class, obj_year, obj_pline, prefix, prog) VALUES (?, ?, ?, ?, ?)",
-                    (obj_class, obj_year, obj_pline, prefix, next_prog)
-                )
-
-            conn.commit()                        
-        except Exception as errMsg:
-            st.error(f"**ERROR impossible to get the next rowid from table TORP_OBJNUMERATOR: {errMsg}")
-            conn.rollback()
-            return ""
-        finally:
-            if cursor:
-                cursor.close() # Close the cursor in a finally block
-    
-    else:
-        st.error(f"**ERROR impossible to get the next rowid for object {obj_class}-{obj_year}-{obj_pline}")
-        return ""
+        key = (obj_class, obj_year, obj_pline)
+        with _objid_lock:
+            block = _objid_blocks.get(key)
+            if block is None or block[1] > block[2]:
+                try:
+                    prefix, last_prog = _reserve_object_ids(obj_class, obj_year, obj_pline, block_size, conn)
+                except Exception as errMsg:
+                    st.error(f"**ERROR impossible to get the next rowid from table TORP_OBJNUMERATOR: {errMsg}")
+                    return ""
+                block = _objid_blocks[key] = [prefix, last_prog - block_size + 1, last_prog]
+            prefix, next_prog = block[0], block[1]
+            block[1] += 1
+        return prefix + obj_year[2:4] + SEP_CHAR + str(next_prog).zfill(ZERO_PADDING_NR)
     
-    return next_rowid
+    st.error(f"**ERROR impossible to get the next rowid for object {obj_class}-{obj_year}-{obj_pline}")
+    return ""
 
 
 def save_request(request: dict, conn) -> Tuple[str, int]:
-    """Save request to database and return request number and status"""
+    """Save request, team leader assignments and attachments in one transaction and return request number and status"""
 
-    try:
-        cursor = conn.cursor()
-        req_year = request["insdate"][0:4]
-        next_reqid = get_next_object_id("REQ", req_year, "", "", conn)
-        sql = """
-            INSERT INTO TORP_REQUESTS (
-                reqid, status, insdate, dept, requester, user, 
-                priority, pline, pfamily, type, category, detail,
-                title, description, note_td, woid
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        values = (
-            next_reqid, request["status"], request["insdate"], request["dept"],
-            request["requester"], request["user"], request["priority"], 
-            request["pline"], request["pfamily"], request["type"], request["category"],
-            request["detail"], request["title"], request["description"], "", "" 
-        )
-        
-        cursor.execute(sql, values)
-        conn.commit()
-        
-    except Exception as e:
-        st.error(f"**ERROR inserting request in TORP_REQUESTS: \n{e}", icon="🚨")
+    req_year = request["insdate"][0:4]
+    next_reqid = get_next_object_id("REQ", req_year, "", "", conn)
+    if not next_reqid:
         return "", False
 
-    try:               
-        for tdtl in request["tdtl_list"]: 
-            sql = """
-                INSERT INTO TORP_REQASSIGNEDTO (
-                    reqid, tdtlid, status
-                ) VALUES (?, ?, ?)
-            """
-            values = (
-                next_reqid, tdtl, "ACTIVE"
+    sql_request = """
+        INSERT INTO TORP_REQUESTS (
+            reqid, status, insdate, dept, requester, user, 
+            priority, pline, pfamily, type, category, detail,
+            title, description, note_td, woid
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    values_request = (
+        next_reqid, request["status"], request["insdate"], request["dept"],
+        request["requester"], request["user"], request["priority"], 
+        request["pline"], request["pfamily"], request["type"], request["category"],
+        request["detail"], request["title"], request["description"], "", "" 
+    )
+    sql_assignment = """
+        INSERT INTO TORP_REQASSIGNEDTO (
+            reqid, tdtlid, status
+        ) VALUES (?, ?, ?)
+    """
+
+    tables = ["TORP_REQUESTS", "TORP_REQASSIGNEDTO"] + (["TORP_ATTACHMENTS"] if request.get("attachments_list") else [])
+    try:
+        with unit_of_work(conn, tables) as cursor:
+            cursor.execute(sql_request, values_request)
+            tdtl_list = request.get("tdtl_list") or []
+            if tdtl_list:
+                cursor.executemany(sql_assignment, [(next_reqid, tdtl, ACTIVE_STATUS) for tdtl in tdtl_list])
+            attachments_list = request.get("attachments_list") or []
+            if attachments_list:
+                _insert_attachments(cursor, next_reqid, attachments_list)
 
-            )
-        
-        cursor.execute(sql, values)
-        conn.commit()
-                    
     except Exception as e:
-        conn.rollback()
-        st.error(f"**ERROR inserting request in TORP_REQASSIGNEDTO: \n{e}", icon="🚨")
+        st.error(f"**ERROR inserting request {next_reqid}: \n{e}", icon="🚨")
         return "", False
     
-    finally:
-        if cursor:
-            cursor.close()  
-    
     return next_reqid, True 
 
 
-def load_attachments_from_db(reqid: str, conn):
-    """Visualizza gli allegati PDF."""
+def load_attachment_list(reqid: str, conn) -> List[Tuple[int, str, int]]:
+    """ Return (rowid, title, size) of the attachments of a request without reading the BLOBs """
 
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor()
-
         sql = """
-            SELECT title, data 
-            FROM TORP_ATTACHMENTS 
-            WHERE reqid = :1 
+            SELECT rowid, title, length(data)
+            FROM TORP_ATTACHMENTS
+            WHERE reqid = ? AND data IS NOT NULL
+            ORDER BY rowid
         """
-        cursor.execute(sql, [reqid])
-        attachments = cursor.fetchall()
+        cursor.execute(sql, (reqid,))
+        return [(rowid, title, size or 0) for rowid, title, size in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _get_cached_attachment(key: Tuple[str, int]) -> Optional[bytes]:
+    with _attachment_cache_lock:
+        data = _attachment_cache.get(key)
+        if data is None:
+            _attachment_cache_stats["misses"] += 1
+        else:
+            _attachment_cache.move_to_end(key)
+            _attachment_cache_stats["hits"] += 1
+        return data
+
+
+def _cache_attachment(key: Tuple[str, int], data: bytes) -> None:
+    global _attachment_cache_bytes
+
+    if len(data) > ATTACHMENT_CACHE_MAX_BYTES:
+        return
+    with _attachment_cache_lock:
+        if key in _attachment_cache:
+            return
+        _attachment_cache[key] = data
+        _attachment_cache_bytes += len(data)
+        while _attachment_cache_bytes > ATTACHMENT_CACHE_MAX_BYTES:
+            _, evicted = _attachment_cache.popitem(last=False)
+            _attachment_cache_bytes -= len(evicted)
+            _attachment_cache_stats["evictions"] += 1
+
+
+def is_attachment_cached(reqid: str, rowid: int) -> bool:
+    with _attachment_cache_lock:
+        return (reqid, rowid) in _attachment_cache
+
+
+def get_attachment_cache_stats() -> Dict[str, int]:
+    """ Return size and hit/miss/eviction counters of the attachment cache """
+
+    with _attachment_cache_lock:
+        return {
+            "files": len(_attachment_cache),
+            "bytes": _attachment_cache_bytes,
+            "max_bytes": ATTACHMENT_CACHE_MAX_BYTES,
+            **_attachment_cache_stats,
+        }
+
+
+def load_attachment_data(reqid: str, rowid: int, size: int, conn, chunk_size: int = ATTACHMENT_CHUNK_SIZE) -> bytes:
+    """ Return the bytes of an attachment, streamed from the database in chunks on a cache miss.
+    Keyed by (reqid, rowid): the rowid of a deleted attachment can be reused by another request """
+
+    key = (reqid, rowid)
+    data = _get_cached_attachment(key)
+    if data is not None:
+        return data
+
+    chunks = []
+    cursor = conn.cursor()
+    try:
+        offset = 1  # substr() offsets are 1-based
+        while offset <= size:
+            cursor.execute(
+                "SELECT substr(data, ?, ?) FROM TORP_ATTACHMENTS WHERE rowid = ? AND reqid = ?",
+                (offset, chunk_size, rowid, reqid)
+            )
+            row = cursor.fetchone()
+            if row is None or not row[0]:
+                break
+            chunks.append(bytes(row[0]))
+            offset += len(row[0])
+    finally:
+        cursor.close()
+
+    data = b"".join(chunks)
+    _cache_attachment(key, data)
+    return data
+
+
+def _show_attachments(reqid: str, conn, file_name: Optional[str] = None, label: str = " Download PDF") -> bool:
+    """ List the attachments of a request; the bytes are read only on download or preview """
+
+    try:
+        attachments = load_attachment_list(reqid, conn)
 
         if not attachments:
             st.info(f"Nessun allegato trovato per la richiesta {reqid}")
-            return
+            return True
 
-        for title, pdf_data in attachments:
-            if pdf_data:
-                #st.subheader(title)
-                with st.expander(title):  # Expander per ogni allegato
+        for rowid, title, size in attachments:
+            with st.expander(f"{title} ({size / 1024:,.0f} KB)"):  # Expander per ogni allegato
+                loaded_key = f"attachment_loaded_{reqid}_{rowid}"
+                loaded = st.session_state.get(loaded_key, False) or is_attachment_cached(reqid, rowid)
+                if not loaded and st.button("Carica allegato", key=f"load_{loaded_key}", icon="📎"):
+                    st.session_state[loaded_key] = loaded = True
+                if loaded:
                     st.download_button(
-                        label=f" Download PDF - {title}",
-                        data=pdf_data,
-                        file_name=f"{title}.pdf",
-                        mime="application/pdf"
+                        label=label,
+                        data=load_attachment_data(reqid, rowid, size, conn),
+                        file_name=file_name or f"{title}.pdf",
+                        mime="application/pdf",
+                        icon="📥",
+                        key=f"download_{rowid}"
                     )
-                    # Visualizzazione PDF (con controllo visibilità)
-                    if st.checkbox("Mostra anteprima", key=f"preview_{title}"): # Checkbox univoco per ogni anteprima
-                        base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-                        pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="1000"></iframe>'
-                        st.markdown(pdf_display, unsafe_allow_html=True)
+                # Visualizzazione PDF (con controllo visibilità)
+                if st.checkbox("Mostra anteprima", key=f"preview_{rowid}"): # Checkbox univoco per ogni anteprima
+                    base64_pdf = base64.b64encode(load_attachment_data(reqid, rowid, size, conn)).decode('utf-8')
+                    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="1000"></iframe>'
+                    st.markdown(pdf_display, unsafe_allow_html=True)
 
     except Exception as e:
         st.error(f"Errore nel caricamento degli allegati: {e}")
         import traceback
         st.error(traceback.format_exc())
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
+        return False
     return True
 
 
+def load_attachments_from_db(reqid: str, conn):
+    """Visualizza gli allegati PDF."""
+
+    return _show_attachments(reqid, conn, label=" Download PDF")
+
+
 def save_attachments(req_id: str, attachments_list: list, conn) -> bool:
     """ Salva i file allegati di una richiesta nella tabella TORP_ATTACHMENTS """
     try:
-        cursor = conn.cursor()
-        for attachments in attachments_list:
-            sql = """
-                INSERT INTO TORP_ATTACHMENTS (class, title, link, data, reqid)
-                VALUES (?, ?, ?, ?, ?)
-            """
-            cursor.execute(sql, (attachments["class_type"], attachments["title"], attachments["link"], attachments["file_content"], req_id))
-            conn.commit()  # Commit AFTER saving
+        with unit_of_work(conn, ["TORP_ATTACHMENTS"]) as cursor:
+            _insert_attachments(cursor, req_id, attachments_list)
     
     except Exception as e:
         st.error(f"Error saving attachment: {e}")
-        conn.rollback() # Rollback on error
         return False
     
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
-    
     return True        
 
 def view_attachments(reqid: str, conn)-> None:
     """Visualizza gli allegati PDF."""
 
-    try:
-        with conn:  # Use a context manager for the connection
-            cursor = conn.cursor()
-
-            sql = """
-                SELECT title, data 
-                FROM TORP_ATTACHMENTS 
-                WHERE reqid = :1 
-            """
-            cursor.execute(sql, [reqid])
-            attachments = cursor.fetchall()
-
-            if not attachments:
-                st.info(f"Nessun allegato trovato per la richiesta {reqid}")
-                return
-
-            for title, pdf_data in attachments:
-                if pdf_data:
-                    #st.subheader(title)
-                    file_name = f"{reqid}_details.pdf"
-                    with st.expander(title):  # Expander per ogni allegato
-                        st.download_button(
-                            label=f" Download PDF",
-                            data=pdf_data,
-                            file_name=file_name,
-                            mime="application/pdf",
-                            icon="📥"
-                        )
-                        # Visualizzazione PDF (con controllo visibilità)
-                        if st.checkbox("Mostra anteprima", key=f"preview_{title}"): # Checkbox univoco per ogni anteprima
-                            base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-                            pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="1000"></iframe>'
-                            st.markdown(pdf_display, unsafe_allow_html=True)
-
-    except Exception as e:
-        st.error(f"Errore nel caricamento degli allegati: {e}")
-        import traceback
-        st.error(traceback.format_exc())
-        return False
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
-    return True
+    return _show_attachments(reqid, conn, file_name=f"{reqid}_details.pdf")
 
     # Database update functions
 def update_request(reqid: str, new_status: str, new_note_td: str, new_woid: str = "", new_tdtl: list=[], conn=""):
@@ -696,340 +1487,549 @@ def update_request(reqid: str, new_status: str, new_note_td: str, new_woid: str
     if isinstance(new_woid, pd.Series):
         new_woid = new_woid.iloc[0]
 
-    # Update TORP_REQUESTS
     try:
-        with conn:  # Use a context manager for the connection
-            cursor = conn.cursor()
+        with unit_of_work(conn, ["TORP_REQUESTS", "TORP_REQASSIGNEDTO"] if new_tdtl else ["TORP_REQUESTS"]) as cursor:
             cursor.execute(
                 "UPDATE TORP_REQUESTS SET status = ?, note_td = ?, woid = ? WHERE reqid = ?",
                 (new_status, new_note_td, new_woid, reqid)
             )
-            conn.commit()
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Error updating TORP_REQUESTS: {str(e)}", icon="🚨")
-        return False
-
-    # Update TORP_REQASSIGNEDTO
-    try:
-        if new_tdtl: # Check if the list is not empty
-        # 1. Disable existing assignments (important to do this *before* inserting new ones)
-            with conn:  # Use a context manager for the connection
-                cursor.execute("UPDATE TORP_REQASSIGNEDTO SET status = ? WHERE reqid = ?", (DISABLED_STATUS, reqid))
-                conn.commit()
-            # 2. Insert new assignments
-                for tdtl in new_tdtl:
-                    try:
-                        # Check if the record already exists in the table
-                        cursor.execute("SELECT 1 FROM TORP_REQASSIGNEDTO WHERE reqid = ? AND tdtlid = ?", (reqid, tdtl))
-                        existing_record = cursor.fetchone()
-                        if existing_record:
-                            # Update the existing record
-                            cursor.execute("UPDATE TORP_REQASSIGNEDTO SET status = ? WHERE reqid = ? AND tdtlid = ?", (ACTIVE_STATUS, reqid, tdtl))
-                        else:
-                            # Insert a new record
-                            cursor.execute("INSERT INTO TORP_REQASSIGNEDTO (reqid, tdtlid, status) VALUES (?, ?, ?)", (reqid, tdtl, ACTIVE_STATUS))
-                        conn.commit()
-                    except Exception as e:
-                        conn.rollback()
-                        st.error(f"Error inserting/updating REQASSIGNEDTO for {tdtl}: {str(e)}", icon="🚨")
-                        return False
-        else:
-            st.warning("Nessun Team Leader fornito per l'aggiornamento di REQASSIGNEDTO", icon="⚠️")
+            if new_tdtl: # Check if the list is not empty
+                _sync_request_assignments(cursor, reqid, new_tdtl)
 
     except Exception as e:
-        conn.rollback()
-        st.error(f"Error updating REQASSIGNEDTO (disabling): {str(e)}", icon="🚨")
+        st.error(f"Error updating request {reqid}: {str(e)}", icon="🚨")
         return False
 
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
+    if not new_tdtl:
+        st.warning("Nessun Team Leader fornito per l'aggiornamento di REQASSIGNEDTO", icon="⚠️")
     
     return True
 
 
-def save_workorder(wo: dict, conn): # Pass connection and cursor
-    
-    try:
-        with conn:
-            cursor = conn.cursor()
-            # Check if a workorder with the given woid already exists
-            cursor.execute("SELECT 1 FROM TORP_WORKORDERS WHERE woid = ? AND tdtlid = ?", (wo["woid"], wo["tdtlid"]))
-            existing_workorder = cursor.fetchone()
-
-            if existing_workorder:
-                # UPDATE
-                sql = """
-                    UPDATE TORP_WORKORDERS SET
-                        type = ?, 
-                        title = ?, 
-                        description = ?,
-                        time_qty = ?, 
-                        time_um = ?, 
-                        status = ?, 
-                        startdate = ?,
-                        enddate = ?, 
-                        reqid = ?, 
-                        sequence = ?
-                    WHERE woid = ?
-                    AND tdtlid = ?
-                """
-                values = (
-                    wo["type"], 
-                    wo["title"], 
-                    wo["description"],
-                    wo["time_qty"], 
-                    wo["time_um"], 
-                    wo["status"], 
-                    wo["startdate"],
-                    wo["enddate"], 
-                    wo["reqid"], 
-                    wo["sequence"], 
-                    wo["woid"], 
-                    wo["tdtlid"]
-                )
-                cursor.execute(sql, values)
-                conn.commit()
-                #st.success(f"Workorder {wo['woid']} updated successfully.") # feedback for the user
+def _sync_request_assignments(cursor, reqid: str, tdtl_list: list) -> None:
+    """ Make tdtl_list the active team leaders of a request with two set-based statements """
+
+    tdtl_list = list(dict.fromkeys(tdtl_list))
+    placeholders = ", ".join("?" * len(tdtl_list))
+    cursor.execute(
+        f"UPDATE TORP_REQASSIGNEDTO SET status = ? WHERE reqid = ? AND status <> ? AND tdtlid NOT IN ({placeholders})",
+        (DISABLED_STATUS, reqid, DISABLED_STATUS, *tdtl_list)
+    )
+    values_sql = ", ".join(["(?, ?, ?)"] * len(tdtl_list))
+    cursor.execute(
+        f"""
+        INSERT INTO TORP_REQASSIGNEDTO (reqid, tdtlid, status) VALUES {values_sql}
+        ON CONFLICT (reqid, tdtlid) DO UPDATE SET status = excluded.status
+        """,
+        [value for tdtl in tdtl_list for value in (reqid, tdtl, ACTIVE_STATUS)]
+    )
+
+
+def upsert_records(cursor, table: str, records: List[dict]) -> None:
+    """ Insert or update records of a table in UPSERT_SPECS by its natural key (ON CONFLICT),
+    with as many rows per statement as the parameter limit allows """
+
+    spec = UPSERT_SPECS[table]
+    columns = spec["columns"]
+    update_columns = [col for col in columns if col not in spec["key"] and col not in spec["insert_only"]]
+    row_sql = "(" + ", ".join("?" * len(columns)) + ")"
+    rows_per_statement = max(1, UPSERT_MAX_PARAMS // len(columns))
+
+    for start in range(0, len(records), rows_per_statement):
+        batch = records[start:start + rows_per_statement]
+        sql = f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            VALUES {", ".join([row_sql] * len(batch))}
+            ON CONFLICT ({", ".join(spec["key"])}) DO UPDATE SET
+                {", ".join(f"{col} = excluded.{col}" for col in update_columns)}
+        """
+        cursor.execute(sql, [record[spec["field"](col)] for record in batch for col in columns])
 
-            else:
-                # INSERT
-                sql = """
-                    INSERT INTO TORP_WORKORDERS (
-                        woid, tdtlid, type, title, description, time_qty, time_um,
-                        status, startdate, enddate, reqid, insdate, sequence
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                values = (
-                    wo["woid"], 
-                    wo["tdtlid"], 
-                    wo["type"], 
-                    wo["title"], 
-                    wo["description"],
-                    wo["time_qty"], 
-                    wo["time_um"], 
-                    wo["status"], 
-                    wo["startdate"],
-                    wo["enddate"], 
-                    wo["reqid"], 
-                    wo["insdate"], 
-                    wo["sequence"]
-                )
-                cursor.execute(sql, values)
-                conn.commit()
-                #st.success(f"Workorder {wo['woid']} created successfully.") # feedback for the user
+
+def save_workorder(wo, conn): # Pass connection and cursor
+    """ Insert or update one workorder dict (or a list of them) and return (woid(s), status) """
+
+    records = wo if isinstance(wo, list) else [wo]
+    try:
+        with unit_of_work(conn, ["TORP_WORKORDERS"]) as cursor:
+            upsert_records(cursor, "TORP_WORKORDERS", records)
 
     except Exception as e:
-        conn.rollback() # important to rollback in case of error!
         st.error(f"**ERROR saving workorder: \n{e}", icon="🚨")
         return "", False
 
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
-
+    if isinstance(wo, list):
+        return [record["woid"] for record in records], True
     return wo["woid"], True
 
-def save_workorder_assignments(woid, tdtl_code, assigned_users, df_users, df_woassignedto, conn):
+def sync_workorder_assignments(woid: str, tdtl_code: str, tdsp_codes: list, conn) -> Optional[pd.DataFrame]:
+    """ Make tdsp_codes the active specialists of (woid, tdtl_code) in one transaction and
+    return the resulting TORP_WOASSIGNEDTO rows (df_woassignedto columns), None on error """
+
+    tdsp_codes = list(dict.fromkeys(tdsp_codes))
     try:
-        # Disable existing assignments
-        with conn:
-            cursor = conn.cursor()
+        with unit_of_work(conn, ["TORP_WOASSIGNEDTO"]) as cursor:
+            # Current assignments and team leader name in one round trip
             cursor.execute(
-                "UPDATE TORP_WOASSIGNEDTO SET status = ? WHERE woid = ? AND tdtlid = ?",
-                (DISABLED_STATUS, woid, tdtl_code)
+                """
+                SELECT B.name, A.tdspid, A.status
+                FROM TORP_USERS B
+                LEFT JOIN TORP_WOASSIGNEDTO A ON A.woid = ? AND A.tdtlid = B.code
+                WHERE B.code = ?
+                """,
+                (woid, tdtl_code)
             )
-            conn.commit()
-            
-            # Add new assignments
-            for user_name in assigned_users:
-                user_code = df_users[df_users["NAME"] == user_name]["CODE"].iloc[0]
-                #st.write(f"{woid} - {tdtl_code} - {user_code} -")
-
-                existing_assignment = df_woassignedto[
-                    (df_woassignedto['WOID'] == woid) & 
-                    (df_woassignedto['TDTLID'] == tdtl_code) &
-                    df_woassignedto['TDSPID'].isin([user_code])
-                  ]  # Usa isin()
-                
-                if existing_assignment.empty:
-                    cursor.execute(
-                        "INSERT INTO TORP_WOASSIGNEDTO (woid, tdtlid, tdspid, status) VALUES (?, ?, ?, ?)",
-                        (woid, tdtl_code, user_code, ACTIVE_STATUS)
-                    )
-                else:
-                    cursor.execute(
-                        "UPDATE TORP_WOASSIGNEDTO SET status = ? WHERE woid = ? AND tdtlid = ? AND tdspid = ?",
-                        (ACTIVE_STATUS, woid, tdtl_code, user_code)
-                    )
-            
-                conn.commit()
-            return True
-    
+            rows = cursor.fetchall()
+            username = rows[0][0] if rows else ""
+            current = {tdspid: status for _, tdspid, status in rows if tdspid is not None}
+
+            to_disable = [code for code, status in current.items() if code not in tdsp_codes and status != DISABLED_STATUS]
+            to_activate = [code for code in tdsp_codes if current.get(code) != ACTIVE_STATUS]
+
+            if to_disable:
+                placeholders = ", ".join("?" * len(to_disable))
+                cursor.execute(
+                    f"UPDATE TORP_WOASSIGNEDTO SET status = ? WHERE woid = ? AND tdtlid = ? AND tdspid IN ({placeholders})",
+                    (DISABLED_STATUS, woid, tdtl_code, *to_disable)
+                )
+            if to_activate:
+                values_sql = ", ".join(["(?, ?, ?, ?)"] * len(to_activate))
+                cursor.execute(
+                    f"""
+                    INSERT INTO TORP_WOASSIGNEDTO (woid, tdtlid, tdspid, status) VALUES {values_sql}
+                    ON CONFLICT (woid, tdtlid, tdspid) DO UPDATE SET status = excluded.status
+                    """,
+                    [value for code in to_activate for value in (woid, tdtl_code, code, ACTIVE_STATUS)]
+                )
+
     except Exception as e:
         st.error(f"Error updating TORP_WOASSIGNEDTO: {str(e)}", icon="🚨")
-        conn.rollback()
-        return False
-    
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
+        return None
 
+    statuses = dict(current)
+    statuses.update({code: DISABLED_STATUS for code in to_disable})
+    statuses.update({code: ACTIVE_STATUS for code in tdsp_codes})
+    return pd.DataFrame(
+        [
+            {"WOID": woid, "TDTLID": tdtl_code, "TDSPID": code, "STATUS": status, "USERNAME": username}
+            for code, status in statuses.items()
+            if status in (ACTIVE_STATUS, DISABLED_STATUS)
+        ],
+        columns=["WOID", "TDTLID", "TDSPID", "STATUS", "USERNAME"]
+    )
 
 
+def save_workitem(witem, conn) ->  bool:
+    """Insert or update one workitem dict (or a list of them) in a single transaction"""
 
-def save_workitem(witem: dict, conn) ->  bool:
-    """Save request to database and return request number and status"""
+    records = witem if isinstance(witem, list) else [witem]
     try:
-        with conn:
-            cursor = conn.cursor()        
-            # Check if a workorder with the given woid already exists
-            cursor.execute("SELECT 1 FROM TORP_WORKITEMS WHERE refdate = ? AND woid = ? AND tdspid = ?", (witem["REFDATE"], witem["WOID"], witem["TDSPID"]))
-            existing_workorder = cursor.fetchone()
-
-            if existing_workorder:
-                # UPDATE
-                sql = """
-                UPDATE TORP_WORKITEMS SET
-                    status = ?, tskgrl1 = ?, tskgrl2 = ?, 
-                    time_qty = ?, description = ?, note = ?
-                WHERE refdate = ?
-                AND woid = ?
-                AND tdspid = ?
-                """
-                values = (
-                    witem["STATUS"], witem["TSKGRL1"], witem["TSKGRL2"],
-                    witem["TIME_QTY"], witem["DESCRIPTION"], witem["NOTE"],
-                    witem["REFDATE"] , witem["WOID"], witem["TDSPID"]
-                )
-                cursor.execute(sql, values)
-                conn.commit()
-                return True                  
+        with unit_of_work(conn, ["TORP_WORKITEMS"]) as cursor:
+            upsert_records(cursor, "TORP_WORKITEMS", records)
 
-            else:
-                sql = """
-                    INSERT INTO TORP_WORKITEMS (
-                        refdate, woid, tdspid, status, 
-                        tskgrl1, tskgrl2, description, note, 
-                        time_qty, time_um
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                values = (
-                    witem["REFDATE"], witem["WOID"], witem["TDSPID"], witem["STATUS"],
-                    witem["TSKGRL1"], witem["TSKGRL2"], witem["DESCRIPTION"], witem["NOTE"], 
-                    witem["TIME_QTY"], witem["TIME_UM"]
-                )
-                cursor.execute(sql, values)
-                conn.commit()
-                return True
-    
     except Exception as e:
         st.error(f"**ERROR inserting/updating data in table TORP_WORKITEM: \n{e}", icon="🚨")
-        conn.rollback()
         return False
 
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
+    return True
 
 
 def update_workitem(witem: dict, conn) -> bool:
+    sql = """
+    UPDATE TORP_WORKITEMS SET
+        status = ?, 
+        tskgrl1 = ?, 
+        tskgrl2 = ?, 
+        time_qty = ?, 
+        description = ?, 
+        note = ?
+    WHERE woid = ?
+    AND tdspid = ?
+    AND refdate = ?
+    """
+    values = (
+        witem["STATUS"], 
+        witem["TSKGRL1"], 
+        witem["TSKGRL2"],
+        witem["TIME_QTY"], 
+        witem["DESCRIPTION"], 
+        witem["NOTE"],
+        witem["WOID"], 
+        witem["TDSPID"], 
+        witem["REFDATE"]  
+    )
     try:
-        with conn:
-            cursor = conn.cursor()        
-
-        sql = """
-        UPDATE TORP_WORKITEMS SET
-            status = ?, 
-            tskgrl1 = ?, 
-            tskgrl2 = ?, 
-            time_qty = ?, 
-            description = ?, 
-            note = ?
-        WHERE woid = ?
-        AND tdspid = ?
-        AND refdate = ?
-        """
-        values = (
-            witem["STATUS"], 
-            witem["TSKGRL1"], 
-            witem["TSKGRL2"],
-            witem["TIME_QTY"], 
-            witem["DESCRIPTION"], 
-            witem["NOTE"],
-            witem["WOID"], 
-            witem["TDSPID"], 
-            witem["REFDATE"]  
-        )
-        cursor.execute(sql, values)
-        conn.commit()        
+        with unit_of_work(conn, ["TORP_WORKITEMS"]) as cursor:
+            cursor.execute(sql, values)
         return True
     except Exception as e:
         st.error(f"**ERROR updating data in table TORP_WORKITEM: \n{e}", icon="🚨")
-        conn.rollback()
         return False
 
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
-
 
 def delete_workitem(witem: dict, conn) ->  bool:
     """Delete workitem """
+    query = """
+        DELETE FROM TORP_WORKITEMS
+        WHERE refdate = ? 
+        AND woid = ? 
+        AND tdspid = ?
+    """
     try:
-        cursor = conn.cursor()
-        query = """
-            DELETE FROM workitems
-            WHERE REFDATE = ? 
-            AND WOID = ? 
-            AND TDSPID = ?
-        """
-        cursor.execute(query, (witem["REFDATE"], witem["WOID"], witem["TDSPID"]))
-        conn.commit()
+        with unit_of_work(conn, ["TORP_WORKITEMS"], mergeable=False) as cursor:
+            cursor.execute(query, (witem["REFDATE"], witem["WOID"], witem["TDSPID"]))
         return True
     except Exception as e:
-        conn.rollback()
         st.error(f"**ERROR deleting data in table TORP_WORKITEM: \n{e}", icon="🚨")
         return False
 
-    finally:
-        if cursor:
-            cursor.close() # Close the cursor in a finally block
 
 
 
+# Master-data loaders whose results are shared across sessions
+REFDATA_LOADERS = (
+    load_dept_data,
+    load_users_data,
+    load_pline_data,
+    load_pfamily_data,
+    load_type_data,
+    load_category_data,
+    load_detail_data,
+    load_lk_type_category_data,
+    load_lk_category_detail_data,
+    load_lk_pline_tdtl_data,
+    load_tskgrl1_data,
+    load_tskgrl2_data,
+    load_permission_data,
+)
+
+# Load data only once and store in session state
+SESSION_DATA = {
+    'df_depts': load_dept_data,
+    'df_users': load_users_data,
+    'df_pline': load_pline_data,
+    'df_pfamily': load_pfamily_data,
+    'df_category': load_category_data,
+    'df_type': load_type_data,
+    'df_lk_type_category': load_lk_type_category_data,
+    'df_lk_category_detail': load_lk_category_detail_data,
+    'df_lk_pline_tdtl': load_lk_pline_tdtl_data,
+    'df_detail': load_detail_data,
+    'df_requests': load_requests_data,
+    'df_reqassignedto': load_reqassignedto_data,
+    'df_attachments': load_attachments_data,
+    'df_workorders': load_workorders_data,
+    'df_woassignedto': load_woassignedto_data,
+    'df_workitems': load_default_workitems_data,
+    'df_tskgrl1': load_tskgrl1_data,
+    'df_tskgrl2': load_tskgrl2_data,
+}
+
+# Session dfs to refetch when the data version of a table moves
+VERSIONED_TABLES = {
+    "TORP_REQUESTS": ["df_requests"],
+    "TORP_REQASSIGNEDTO": ["df_reqassignedto"],
+    "TORP_ATTACHMENTS": ["df_attachments"],
+    "TORP_WORKORDERS": ["df_workorders"],
+    "TORP_WOASSIGNEDTO": ["df_woassignedto"],
+    "TORP_WORKITEMS": ["df_workitems"],
+}
+
+
+def refresh_changed_data(conn) -> List[str]:
+    """ Once per rerun: refetch the session dfs of the tables written (by anyone) since this
+    session last read them, and return their keys. Costs one poll shared by the process. """
+
+    seen = st.session_state.get("data_versions")
+    versions = poll_data_versions(conn)
+    if seen is None or not versions:
+        return []
+
+    refreshed = []
+    worker_running = is_refresh_worker_running()
+    for table, version in versions.items():
+        # Versions only grow: a poll up to VERSION_POLL_INTERVAL old can lag behind an own write
+        if seen.get(table, 0) >= version:
+            continue
+        new_seen = version
+        for key in VERSIONED_TABLES.get(table, []):
+            if st.session_state.get(key) is None:
+                continue
+            if key in HOT_TABLE_KEYS and worker_running:
+                # Never block on the database: take the worker's snapshot once it is newer
+                snapshot = get_hot_snapshot(key)
+                if snapshot is None or snapshot["version"] <= seen.get(table, 0):
+                    new_seen = seen.get(table, 0)
+                    continue
+                _adopt_hot_snapshot(key, snapshot)
+                new_seen = snapshot["version"]
+            elif key in SYNC_TABLES:
+                reload_session_data(key, conn)
+            else:
+                st.session_state[key] = SESSION_DATA[key](conn)
+            refreshed.append(key)
+        seen[table] = max(seen.get(table, 0), new_seen)
+    return refreshed
+
+
+def get_hot_snapshot(key: str) -> Optional[dict]:
+    """ Return the refresh worker's latest snapshot of a hot table (None if not loaded yet) """
+    with _hot_lock:
+        return _hot_snapshots.get(key)
+
+
+def _adopt_hot_snapshot(key: str, snapshot: dict) -> None:
+    spec = SYNC_TABLES[key]
+    st.session_state[key] = snapshot["df"]
+    st.session_state.setdefault("sync_hwm", {})[key] = snapshot["hwm"]
+    if "windows_key" in spec:
+        st.session_state.pop(spec["windows_key"], None)  # The snapshot holds the loader's default window
+
+
+def _refresh_hot_tables(conn) -> None:
+    """ Reload the hot tables whose data version moved (or loaded on an earlier day: the
+    default df_workitems window follows the date) and swap the new snapshots in """
+
+    versions = poll_data_versions(conn, max_age=0)
+    if versions is None:
+        raise RuntimeError("TORP_DATA_VERSION poll failed")
+    today = date.today()
+    for key in HOT_TABLE_KEYS:
+        spec = SYNC_TABLES[key]
+        version = versions.get(spec["table"], 0)
+        snapshot = get_hot_snapshot(key)
+        if snapshot is not None and snapshot["version"] == version and snapshot["loaded_on"] == today:
+            continue
+        # Version and high-water mark are read *before* the load, as in reload_session_data
+        hwm = get_max_rowid(spec["table"], conn)
+        df = spec["loader"](conn)
+        if df is None:
+            raise RuntimeError(f"load of {key} failed")
+        with _hot_lock:
+            _hot_snapshots[key] = {"version": version, "df": df, "hwm": hwm, "loaded_on": today}
+
+
+def _hot_refresh_loop() -> None:
+    pool = get_connection_pool()
+    while True:
+        conn = None
+        broken = False
+        try:
+            conn = pool.acquire()
+            _refresh_hot_tables(conn)
+        except Exception:
+            logger.exception("Hot table refresh failed, serving the previous snapshots")
+            broken = True
+        finally:
+            if conn is not None:
+                pool.release(conn, broken=broken)
+        time.sleep(HOT_REFRESH_INTERVAL)
+
+
+def start_refresh_worker() -> None:
+    """ Start the process-wide background thread keeping the hot tables materialized (idempotent) """
+    global _hot_worker
+
+    with _hot_lock:
+        if _hot_worker is None or not _hot_worker.is_alive():
+            _hot_worker = threading.Thread(target=_hot_refresh_loop, name="hot-table-refresh", daemon=True)
+            _hot_worker.start()
+
+
+def is_refresh_worker_running() -> bool:
+    with _hot_lock:
+        return _hot_worker is not None and _hot_worker.is_alive()
+
+
+def get_refdata(loader, conn, ttl: int = None):
+    """ Return a master-data df from the process cache, loading it on miss or expiry.
+    The returned df is shared by all sessions and must not be modified in place. """
+
+    if ttl is None:
+        ttl = REFDATA_CACHE_TTL
+    key = loader.__name__
+    now = time.monotonic()
+
+    with _refdata_cache_lock:
+        entry = _refdata_cache.get(key)
+        if entry is not None and now - entry[0] < ttl:
+            _refdata_cache_stats["hits"] += 1
+            return entry[1]
+        _refdata_cache_stats["misses"] += 1
+
+    df = loader(conn)
+    if df is not None:  # Never cache a failed load
+        with _refdata_cache_lock:
+            _refdata_cache[key] = (time.monotonic(), df)
+    return df
+
+
+def invalidate_refdata(loader=None) -> None:
+    """ Drop one master-data table (or all of them) from the process cache """
+
+    with _refdata_cache_lock:
+        if loader is None:
+            _refdata_cache.clear()
+        else:
+            _refdata_cache.pop(loader.__name__, None)
+
+
+def refresh_refdata(conn) -> None:
+    """ Refresh buttons: drop the process cache of master data and reload the
+    master-data dfs held by this session (other sessions pick it up as they miss) """
+
+    invalidate_refdata()
+    for key, loader in SESSION_DATA.items():
+        if loader in REFDATA_LOADERS and st.session_state.get(key) is not None:
+            df = get_refdata(loader, conn)
+            if df is not None:
+                st.session_state[key] = df
+
+
+def get_refdata_cache_stats() -> Dict[str, int]:
+    """ Return hit/miss counters and the number of cached master-data tables """
+
+    with _refdata_cache_lock:
+        return {
+            "hits": _refdata_cache_stats["hits"],
+            "misses": _refdata_cache_stats["misses"],
+            "tables": len(_refdata_cache),
+        }
 
-def initialize_session_state(conn): #passo la connessione
-        # Load data only once and store in session state
-    session_data = {
-        'df_depts': load_dept_data,
-        'df_users': load_users_data,
-        'df_pline': load_pline_data,
-        'df_pfamily': load_pfamily_data,
-        'df_category': load_category_data,
-        'df_type': load_type_data,
-        'df_lk_type_category': load_lk_type_category_data,
-        'df_lk_category_detail': load_lk_category_detail_data,
-        'df_lk_pline_tdtl': load_lk_pline_tdtl_data,
-        'df_detail': load_detail_data,
-        'df_requests': load_requests_data,
-        'df_reqassignedto': load_reqassignedto_data,
-        'df_attachments': load_attachments_data,
-        'df_workorders': load_workorders_data,
-        'df_woassignedto': load_woassignedto_data,
-        'df_workitems': load_workitems_data,
-        'df_tskgrl1': load_tskgrl1_data,
-        'df_tskgrl2': load_tskgrl2_data,
+
+def is_refdata_cached(loader, ttl: int = None) -> bool:
+    """ Check whether a master-data table is in the process cache and not expired """
+
+    if ttl is None:
+        ttl = REFDATA_CACHE_TTL
+    with _refdata_cache_lock:
+        entry = _refdata_cache.get(loader.__name__)
+        return entry is not None and time.monotonic() - entry[0] < ttl
+
+
+def _timed_load(key: str, loader, conn):
+    """ Run one session loader and return (key, df, rowid high-water mark, elapsed seconds) """
+
+    start = time.perf_counter()
+    hwm = None
+    if loader in REFDATA_LOADERS:
+        df = get_refdata(loader, conn)
+    elif key in SYNC_TABLES and SYNC_TABLES[key]["loader"] is loader:
+        hwm = get_max_rowid(SYNC_TABLES[key]["table"], conn)
+        df = loader(conn)
+    else:
+        df = loader(conn)
+    return key, df, hwm, time.perf_counter() - start
+
+
+def _load_serial(loaders: dict, conn) -> list:
+    """ Run session loaders one after the other on conn """
+
+    results = []
+    for key, loader in loaders.items():
+        try:
+            results.append(_timed_load(key, loader, conn))
+        except Exception as e:
+            results.append((key, e, None, 0.0))
+    return results
+
+
+def _load_parallel(loaders: dict, max_workers: int, conn) -> list:
+    """ Run session loaders concurrently on pooled connections reserved up front without
+    waiting (serially on conn when none is free). The session connection is given back
+    first, so a startup never holds one connection while waiting for others. """
+
+    pool = get_connection_pool()
+    release_sqlitecloud_db(conn)
+    reserved = []
+    try:
+        while len(reserved) < max_workers:
+            worker_conn = pool.try_acquire()
+            if worker_conn is None:
+                break
+            reserved.append(worker_conn)
+    except Exception:
+        pass  # Cannot open more connections now: use the ones reserved so far
+    if not reserved:
+        return _load_serial(loaders, conn)
+
+    ctx = get_script_run_ctx()
+    free = queue.SimpleQueue()
+    for worker_conn in reserved:
+        free.put(worker_conn)
+
+    def run(key, loader):
+        add_script_run_ctx(threading.current_thread(), ctx)  # Allow st.error from the worker
+        worker_conn = free.get()
+        try:
+            return _timed_load(key, loader, worker_conn)
+        finally:
+            free.put(worker_conn)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(reserved)) as executor:
+            futures = {executor.submit(run, key, loader): key for key, loader in loaders.items()}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append((futures[future], e, None, 0.0))
+    finally:
+        for worker_conn in reserved:
+            pool.release(worker_conn)
+    return results
+
+
+def initialize_session_state(conn, session_data: dict = None, parallel: bool = False): #passo la connessione
+    """ Load missing session dataframes, serving master data from the process cache.
+    With parallel=True the remote loads run concurrently on up to STARTUP_WORKERS pooled connections. """
+    if session_data is None:
+        session_data = SESSION_DATA
+    if "data_versions" not in st.session_state:
+        # Versions read *before* the first load: a write in between causes a reload, never a miss
+        st.session_state.data_versions = dict(poll_data_versions(conn, max_age=0) or {})
+
+    missing = {
+        key: loader for key, loader in session_data.items()
+        if key not in st.session_state or st.session_state[key] is None  # Controllo più robusto
     }
+    if not missing:
+        return
 
-    # for key, loader in session_data.items():
-    #     if key not in st.session_state:
-    #         st.session_state[key] = loader(conn)
-    for key, loader in session_data.items():
-        if key not in st.session_state or st.session_state[key] is None:  # Controllo più robusto
-            try:
-                st.session_state[key] = loader(conn)
-            except Exception as e:  # Gestione errori
-                st.error(f"Errore caricamento dati per {key}: {e}")
-                st.stop()  # Importante: ferma l'esecuzione se il caricamento fallisce
\ No newline at end of file
+    # Cache hits need no round trip: serve them here and send only remote loads to the workers
+    remote = {key: loader for key, loader in missing.items() if not (loader in REFDATA_LOADERS and is_refdata_cached(loader))}
+    results = [_timed_load(key, loader, conn) for key, loader in missing.items() if key not in remote]
+
+    # Hot tables already materialized by the refresh worker need no round trip either
+    hot = {
+        key: get_hot_snapshot(key) for key, loader in remote.items()
+        if key in HOT_TABLE_KEYS and loader is SYNC_TABLES[key]["loader"]
+    }
+    for key, snapshot in hot.items():
+        if snapshot is None:
+            continue
+        results.append((key, snapshot["df"], snapshot["hwm"], 0.0))
+        del remote[key]
+        # The snapshot may be older than the versions read above: make the next poll catch up
+        table = SYNC_TABLES[key]["table"]
+        seen = st.session_state.data_versions
+        seen[table] = min(seen.get(table, 0), snapshot["version"])
+
+    if parallel and len(remote) > 1:
+        results += _load_parallel(remote, min(STARTUP_WORKERS, len(remote)), conn)
+    else:
+        results += _load_serial(remote, conn)
+
+    if "load_timings" not in st.session_state:
+        st.session_state.load_timings = {}
+    if "sync_hwm" not in st.session_state:
+        st.session_state.sync_hwm = {}
+    for key, df, hwm, elapsed in results:
+        if isinstance(df, Exception):  # Gestione errori
+            st.error(f"Errore caricamento dati per {key}: {df}")
+            st.stop()  # Importante: ferma l'esecuzione se il caricamento fallisce
+        st.session_state[key] = df
+        st.session_state.load_timings[key] = elapsed
+        if key in SYNC_TABLES and SYNC_TABLES[key]["loader"] is missing[key]:
+            st.session_state.sync_hwm[key] = hwm
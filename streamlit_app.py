@@ -28,6 +28,11 @@ import pandas as pd
 import sqlitecloud
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, JsCode, ColumnsAutoSizeMode
 
+# The session dfs are immutable snapshots shared by reruns, sessions and the refresh worker:
+# with copy-on-write (pandas >= 2.0), the pages' filters and column selections of them are
+# lazy and never write through, so they need no defensive copies
+pd.set_option("mode.copy_on_write", True)
+
 # Global constants
 APPNAME = "TORP" #IPH Technical Office Request POC (Proof Of Concept)
 APPCODE = "TORP"
@@ -46,9 +51,13 @@ def main():
     # Open connection to SQLITE db
     conn = sqlite_db.open_sqlitecloud_db()
     if conn:
+      # Keep the hot tables materialized in the background (one worker per server process)
+      sqlite_db.start_refresh_worker()
       # Load initial data
       with st.spinner(text="Loading data..."):
-        sqlite_db.initialize_session_state(conn)
+        sqlite_db.initialize_session_state(conn, parallel=True)
+        # Refetch only the tables written by other sessions since the last rerun
+        sqlite_db.refresh_changed_data(conn)
     else:
       st.error("Database connection failed!") 
       st.stop() 
@@ -92,4 +101,8 @@ def main():
 
            
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # Give the pooled connection back at the end of every page run
+        sqlite_db.release_sqlitecloud_db(st.session_state.get("conn"))
\ No newline at end of file
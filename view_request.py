@@ -10,6 +10,7 @@ import time
 # Internal app module
 import servant
 import sqlite_db
+import request_store
 
 
 def view_requests(conn) -> None:
@@ -68,28 +69,39 @@ def view_requests(conn) -> None:
         'df_attachments': sqlite_db.load_attachments_data
     }
 
-    for key, loader in session_data.items():
-        if key not in st.session_state:
-            st.session_state[key] = loader(conn)
+    sqlite_db.initialize_session_state(conn, session_data)
 
-    df_requests_grid = pd.DataFrame()
+    # Sidebar controls - Filters
+    st.sidebar.header("Filters")
+    # Creation of a filter REQUESTERNAME
+    requester_codes = st.session_state.df_requests['REQUESTER'].drop_duplicates()
+    option_requestername_list = sorted(servant.get_descriptions_from_codes(st.session_state.df_users, requester_codes, "NAME").tolist())
 
-    # Aggiungere all'inizio della funzione assign_request(), dopo le altre inizializzazioni
-    if "grid_refresh" not in st.session_state:
-        st.session_state.grid_refresh = False
+    # Get an optional value requester filter
+    requestername_filter = st.sidebar.selectbox("Select a Requester Name:", option_requestername_list, index=None)
+    requester_filter_code = servant.get_code_from_name(st.session_state.df_users, requestername_filter, "CODE") if requestername_filter else None
 
-    df_requests_grid['REQID'] = st.session_state.df_requests['REQID']
-    df_requests_grid['STATUS'] = st.session_state.df_requests['STATUS']
-    df_requests_grid['INSDATE'] = st.session_state.df_requests['INSDATE'].dt.strftime('%d/%m/%Y')
-#    df_requests_grid['DEPTNAME'] = df_requests['DEPT'].apply(lambda dept_code: get_description_from_code(df_depts, dept_code, "NAME"))
-    df_requests_grid['PRIORITY'] = st.session_state.df_requests['PRIORITY']
-    df_requests_grid['PRLINE_NAME'] = st.session_state.df_requests['PR_LINE'].apply(lambda pline_code: servant.get_description_from_code(st.session_state.df_pline, pline_code, "NAME"))
-    df_requests_grid['TITLE'] = st.session_state.df_requests['TITLE']
-    df_requests_grid['REQUESTER_NAME'] = st.session_state.df_requests['REQUESTER'].apply(lambda requester_code: servant.get_description_from_code(st.session_state.df_users, requester_code, "NAME"))
+    # Ordinamento eseguito dal database (la griglia mostra una sola pagina)
+    sort_by = st.sidebar.selectbox("Sort by:", list(sqlite_db.REQUESTS_GRID_COLUMNS), index=0, key="vr_sort_by")
+    sort_descending = st.sidebar.toggle("Descending", value=True, key="vr_sort_desc")
 
-    if st.session_state.grid_refresh:
-        st.session_state.grid_data = df_requests_grid.copy()
-        st.session_state.grid_refresh = False    
+    # Carica dal database solo la pagina visibile, filtrata e ordinata
+    page = servant.get_grid_page("vr_grid_page", (requester_filter_code, sort_by, sort_descending))
+    df_page, total_rows = sqlite_db.load_requests_page(
+        conn, {"REQUESTER": requester_filter_code}, sort_by, sort_descending, page
+    )
+    if df_page is None:
+        st.stop()
+    servant.clamp_grid_page("vr_grid_page", total_rows, sqlite_db.REQUESTS_PAGE_SIZE)
+
+    df_requests_grid = pd.DataFrame()
+    df_requests_grid['REQID'] = df_page['REQID']
+    df_requests_grid['STATUS'] = df_page['STATUS']
+    df_requests_grid['INSDATE'] = df_page['INSDATE'].dt.strftime('%d/%m/%Y')
+    df_requests_grid['PRIORITY'] = df_page['PRIORITY']
+    df_requests_grid['PRLINE_NAME'] = servant.get_descriptions_from_codes(st.session_state.df_pline, df_page['PR_LINE'], "NAME")
+    df_requests_grid['TITLE'] = df_page['TITLE']
+    df_requests_grid['REQUESTER_NAME'] = servant.get_descriptions_from_codes(st.session_state.df_users, df_page['REQUESTER'], "NAME")
 
     cellStyle = JsCode("""
         function(params) {
@@ -105,27 +117,16 @@ def view_requests(conn) -> None:
         """)
 
     grid_builder = GridOptionsBuilder.from_dataframe(df_requests_grid)
-    # makes columns resizable, sortable and filterable by default
+    # makes columns resizable; sorting, filtering and paging are done in SQL
     grid_builder.configure_default_column(
         resizable=True,
-        filterable=True,
-        sortable=True,
+        filterable=False,
+        sortable=False,
         editable=False,
         enableRowGroup=False
     )
-    # Enalble pagination
-    grid_builder.configure_pagination(paginationAutoPageSize=False, paginationPageSize=12)
-#    gb.configure_selection('single', use_checkbox=True)
+    grid_builder.configure_pagination(enabled=False)
     grid_builder.configure_grid_options(domLayout='normal')
-#    grid_builder.configure_pagination(enabled=True, paginationPageSize=5, paginationAutoPageSize=True)
-#    grid_builder.configure_selection(selection_mode="multiple", use_checkbox=True)
-#    grid_builder.configure_side_bar(filters_panel=True)# defaultToolPanel='filters')    
-    
-    # grid_builder.configure_column(
-    # field="INSDATE",
-    # header_name="INSERT DATE",
-    # valueFormatter="value != undefined ? new Date(value).toLocaleString('it-IT', {dateStyle:'short'}): ''",
-    # )
     grid_builder.configure_column("REQID", cellStyle=cellStyle)   
     grid_builder.configure_selection(
     selection_mode='single',     # Enable multiple row selection
@@ -136,33 +137,10 @@ def view_requests(conn) -> None:
     # List of available themes
     available_themes = ["streamlit", "alpine", "balham", "material"]
     
-    # Inizializzazione della sessione
-    if "grid_data" not in st.session_state:
-        st.session_state.grid_data = df_requests_grid.copy()  # Copia per evitare modifiche al DataFrame originale
+    st.session_state.grid_data = df_requests_grid
     if "grid_response" not in st.session_state:
         st.session_state.grid_response = None
 
-    # Sidebar controls - Filters
-    st.sidebar.header("Filters")
-    # Creation of a filter REQUESTERNAME
-    ct_requester = df_requests_grid['REQUESTER_NAME'].drop_duplicates().sort_values()
-    df_requestername = st.session_state.df_users[st.session_state.df_users["CODE"].isin(ct_requester)]
-    option_requestername = df_requestername['NAME'].sort_values()
-    
-    
-    option_requestername_list = ct_requester.tolist()
-
-    # Get an optional value requester filter
-    requestername_filter = st.sidebar.selectbox("Select a Requester Name:", option_requestername_list, index=None)
-    #requester_filter_code = get_code_from_name(df_users, requester_filter, "CODE")
-    
-
-    # Filtro e AGGIORNAMENTO DEI DATI (utilizzando la sessione)
-    if requestername_filter:
-        st.session_state.grid_data = df_requests_grid.loc[df_requests_grid["REQUESTER_NAME"] == requestername_filter].copy()
-    else:
-        st.session_state.grid_data = df_requests_grid.copy() # Mostra tutti i dati se il filtro è None
-
     st.subheader(":orange[Request list]") 
     # Creazione/Aggiornamento della griglia (UNA SOLA VOLTA per ciclo di esecuzione)
     with st.container(border=True):
@@ -176,11 +154,12 @@ def view_requests(conn) -> None:
             data_return_mode=DataReturnMode.AS_INPUT,
             key="main_grid"
         )
-
+        servant.show_grid_pager("vr_grid_page", total_rows, sqlite_db.REQUESTS_PAGE_SIZE)
 
         col1, col2, col3 = st.columns([1, 1, 4])
         with col1:
             if st.button("🔄 Refresh", type="tertiary"):
+                sqlite_db.refresh_refdata(conn)
                 reset_application_state()
    
     selected_row = st.session_state.grid_response['selected_rows']
@@ -192,29 +171,22 @@ def view_requests(conn) -> None:
         requester_name = selected_row['REQUESTER_NAME'].iloc[0]
         pline_name = selected_row['PRLINE_NAME'].iloc[0]
 
-        dept_code = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["DEPT"].values[0]
-        dept_name = servant.get_description_from_code(st.session_state.df_depts, dept_code, "NAME")
-
-        family_code = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["PR_FAMILY"].values[0]
-        family_name = servant.get_description_from_code(st.session_state.df_pfamily, family_code, "NAME")
-
-        type_code = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["TYPE"].values[0]
-        type_name = servant.get_description_from_code(st.session_state.df_type, type_code, "NAME")
-        
-        category_code = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["CATEGORY"].values[0]
-        category_name = servant.get_description_from_code(st.session_state.df_category, category_code, "NAME")
-
-        detail_code = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["DETAIL"].values[0]
-        detail_name = servant.get_description_from_code(st.session_state.df_detail, detail_code, "NAME")
+        # Record completo della richiesta (accesso diretto per REQID)
+        request_record = request_store.get_request_record(reqid, conn)
+        if request_record is None:
+            st.warning(f"Request {reqid} not found: it may have been deleted")
+            st.stop()
+        dept_name = request_record["DEPT_NAME"]
+        family_name = request_record["FAMILY_NAME"]
+        type_name = request_record["TYPE_NAME"]
+        category_name = request_record["CATEGORY_NAME"]
+        detail_name = request_record["DETAIL_NAME"]
 
         title = selected_row['TITLE'].iloc[0]
-        description = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["DESCRIPTION"].values[0]
-        note_td = st.session_state.df_requests[st.session_state.df_requests["REQID"] == reqid]["NOTE_TD"].values[0]
+        description = request_record["DESCRIPTION"]
+        note_td = request_record["NOTE_TD"]
 
-        tdtl_code_list = st.session_state.df_reqassignedto[st.session_state.df_reqassignedto["REQID"] == reqid]["TDTLID"]
-        #tdtl_name_list = get_description_from_code(df_users, tdtl_code_list, "NAME")
-        tdtl_name_list = [servant.get_description_from_code(st.session_state.df_users, code, "NAME") for code in tdtl_code_list]
-        tdtl_name_string = "-".join(tdtl_name_list)
+        tdtl_name_string = "-".join(request_record["TDTL_NAMES"])
         
         #st.write(st.session_state["USER_ROLE"])
         user_perm = st.session_state.df_permission[
@@ -229,9 +201,7 @@ def view_requests(conn) -> None:
         else:
             st.write("Nessun permesso trovato.")
 
-        attachments= st.session_state.df_attachments[st.session_state.df_attachments["REQID"] == reqid]["TITLE"]
-        attachments_list = attachments.tolist()
-        attachments_string = "-".join(attachments_list)        
+        attachments_string = "-".join(request_record["ATTACHMENTS"])
 
         # Dati aggiornati
         data_out = {
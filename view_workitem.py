@@ -29,14 +29,12 @@ def view_workitems(conn) -> None :
         'df_attachments': sqlite_db.load_attachments_data,
         'df_workorders': sqlite_db.load_workorders_data,
         'df_woassignedto': sqlite_db.load_woassignedto_data,
-        'df_workitems': sqlite_db.load_workitems_data,
+        'df_workitems': sqlite_db.load_default_workitems_data,
         'df_tskgrl1': sqlite_db.load_tskgrl1_data,
         'df_tskgrl2': sqlite_db.load_tskgrl2_data,
     }
 
-    for key, loader in session_data.items():
-        if key not in st.session_state:
-            st.session_state[key] = loader(conn)
+    sqlite_db.initialize_session_state(conn, session_data)
 
     st.sidebar.divider()
     
@@ -68,12 +66,10 @@ def view_workitems(conn) -> None :
     
     #st.write(filtered_tdsp_woassignedto)
     
-    tdsp_woassignedto_names = []  # Lista per i nomi predefiniti
-    for code in filtered_tdsp_woassignedto["TDSPID"]: # Itero sui codici
-        name = servant.get_description_from_code(st.session_state.df_users, code, "NAME")
-        if name not in tdsp_woassignedto_names:
-            tdsp_woassignedto_names.append(name)
-        sorted(tdsp_woassignedto_names)    
+    # Nomi dei TD Specialist (senza duplicati, nell'ordine di assegnazione)
+    tdsp_woassignedto_names = servant.get_descriptions_from_codes(
+        st.session_state.df_users, filtered_tdsp_woassignedto["TDSPID"], "NAME"
+    ).drop_duplicates().tolist()
 
     #st.write(tdsp_woassignedto_names)
     # Select TD Specialist Name with dynamic filtering
@@ -106,19 +102,22 @@ def view_workitems(conn) -> None :
         format="DD/MM/YYYY"
     )
 
+    # Load (only) the days of the selected range not in memory yet
+    sqlite_db.ensure_workitems_window(conn, selected_from_date, selected_to_date, selected_tdsp_code)
+
     # Check if a username is selected
     if selected_tdsp_name:       
         # Filter workitems dynamically
         filtered_workitems = st.session_state.df_workitems[
-            (st.session_state.df_workitems["TDSPID"] == selected_tdsp_name) &
-            (st.session_state.df_workitems["REFDATE"].dt.date >= selected_from_date) &
-            (st.session_state.df_workitems["REFDATE"].dt.date <= selected_to_date)
+            (st.session_state.df_workitems["TDSPID"] == selected_tdsp_code) &
+            (st.session_state.df_workitems["REFDATE"] >= pd.Timestamp(selected_from_date)) &
+            (st.session_state.df_workitems["REFDATE"] < pd.Timestamp(selected_to_date) + pd.Timedelta(days=1))
         ]
     else:
         # Filter workitems dynamically
         filtered_workitems = st.session_state.df_workitems[
-            (st.session_state.df_workitems["REFDATE"].dt.date >= selected_from_date) &
-            (st.session_state.df_workitems["REFDATE"].dt.date <= selected_to_date)
+            (st.session_state.df_workitems["REFDATE"] >= pd.Timestamp(selected_from_date)) &
+            (st.session_state.df_workitems["REFDATE"] < pd.Timestamp(selected_to_date) + pd.Timedelta(days=1))
         ]    
 
 
@@ -128,17 +127,9 @@ def view_workitems(conn) -> None :
         df_out['REFDATE'] = filtered_workitems['REFDATE'].dt.date  # Convert to date objects            
         
         # Apply the function to get descriptions
-        df_out['TSKGRL1_DESC'] = filtered_workitems['TSKGRL1'].apply(
-            lambda code: servant.get_description_from_code(st.session_state.df_tskgrl1, code, "NAME")
-        )
-
-        df_out['TSKGRL2_DESC'] = filtered_workitems['TSKGRL2'].apply(
-            lambda code: servant.get_description_from_code(st.session_state.df_tskgrl2, code, "NAME")
-        )
-
-        df_out['TDSP_DESC'] = filtered_workitems['TDSPID'].apply(
-            lambda code: servant.get_description_from_code(st.session_state.df_users, code, "NAME")
-        )            
+        df_out['TSKGRL1_DESC'] = servant.get_descriptions_from_codes(st.session_state.df_tskgrl1, filtered_workitems['TSKGRL1'], "NAME")
+        df_out['TSKGRL2_DESC'] = servant.get_descriptions_from_codes(st.session_state.df_tskgrl2, filtered_workitems['TSKGRL2'], "NAME")
+        df_out['TDSP_DESC'] = servant.get_descriptions_from_codes(st.session_state.df_users, filtered_workitems['TDSPID'], "NAME")
 
         df_to_display = df_out.drop(columns=["TSKGRL1", 
                                              "TSKGRL1_DESC", 
@@ -172,7 +163,7 @@ def view_workitems(conn) -> None :
 
             else:
                 # Group by WOID and sum TIME_QTY
-                grouped_workitems = df_to_display.groupby(["WOID", "TDSP_DESC", "TIME_UM"])["TIME_QTY"].sum().reset_index()
+                grouped_workitems = df_to_display.groupby(["WOID", "TDSP_DESC", "TIME_UM"], observed=True)["TIME_QTY"].sum().reset_index()
                 grouped_workitems = grouped_workitems[["WOID", "TDSP_DESC","TIME_QTY", "TIME_UM"]]
                 st.dataframe(data=grouped_workitems, use_container_width=True, hide_index=True)
     